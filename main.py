@@ -6,16 +6,23 @@ import re
 import sys
 import traceback
 import asyncio
+import bisect
+import functools
+import heapq
+import math
 import zipfile
 import inspect
 import shutil
+import copy
+from collections import OrderedDict, deque
 from html import escape
+from types import SimpleNamespace
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from telegram.error import BadRequest, Forbidden
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
 from telegram.constants import ParseMode
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputMediaDocument
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, ApplicationBuilder
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, ApplicationBuilder, BaseRateLimiter
 
 # Load bot token from Railway environment
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -28,21 +35,32 @@ START_TIME = time.time()
 UPDATE_DATE = datetime.fromtimestamp(START_TIME, ZoneInfo("Asia/Kolkata")).strftime("%d-%m-%Y")
 LAST_ERROR_TIME = 0
 ERROR_COOLDOWN = 30
+ALERTS = {}  # "kind|source" -> grouped events waiting for the next digest (persisted in state.json)
 BROADCAST_SESSION = {}
 state_lock = asyncio.Lock()
 
+# === CONCURRENCY ===
+USER_LOCKS = {}    # user_id -> Lock, guards that user's USER_STATE session (private chat updates + background tasks)
+CHAT_LOCKS = {}    # chat_id -> Lock, keeps updates of one group/channel in arrival order
+
 # === DEFAULT GLOBAL DICTS ===
 USER_STATE = {}
-AUTO4_STATE = {
-    "pending_apks": [],
-    "timer": None,
-    "waiting_since": None,
-    "countdown_msg_id": None,
-    "setup_mode": 1
-}
 AUTO_SETUP = {}
 USER_DATA = {}
 
+# === AUTO-FORWARD DELAY QUEUE ===
+AUTO_HOLD_SECONDS = 20     # default upper bound of a setup's hold window (hold_max)
+AUTO_JOBS = {}            # job_id -> job dict (written through to AUTO_JOBS_FILE)
+AUTO_JOBS_FILE = "auto_jobs.json"
+AUTO_JOBS_FLUSH_DELAY = 0.5   # job changes within this window share one write of AUTO_JOBS_FILE
+auto_jobs_dirty = asyncio.Event()
+auto_jobs_write_lock = asyncio.Lock()
+AUTO_QUEUE = []           # heap of (due_time, seq, job_id)
+AUTO_QUEUE_SEQ = 0
+auto_queue_event = asyncio.Event()
+AUTO_WINDOWS = {}          # collection window key -> job_id; later posts for the key join that job
+ALBUM_COLLECT_SECONDS = 3  # an album job waits at least this long so every part can arrive
+
 # === Load config.json ===
 with open("config.json") as f:
     config = json.load(f)
@@ -52,6 +70,13 @@ ALLOWED_USERS = set(config.get("allowed_users", []))
 USER_DATA = config.get("user_data", {})
 BOT_ADMIN_LINK = config.get("bot_admin_link", "")
 BOT_ACTIVE = config.get("bot_active", True)
+CONCURRENT_UPDATES = config.get("concurrent_updates", 64)  # 0 = process updates one by one
+UPDATE_BACKLOG = 1024  # updates PTB may hold at once, running or waiting for their chat (see per_chat)
+UPDATE_SLOTS = asyncio.Semaphore(CONCURRENT_UPDATES or 1)  # handlers running at once, taken after the chat's lock
+RECAPTION_IN_PLACE = config.get("recaption_in_place", True)  # False = always repost on re-caption
+ALBUM_POSTING = config.get("album_posting", True)  # post a whole session as one media group
+ALBUM_MAX_ITEMS = 10  # Telegram's media group limit
+ALERT_DIGEST_INTERVAL = config.get("alert_digest_interval", 300)  # seconds between owner alert digests
 
 AUTO_SETUP = config.get("auto_setup", {
     "setup1": {
@@ -100,7 +125,8 @@ CENTRAL_AUTHORITY_BTN = InlineKeyboardMarkup([
 
 # === Load saved state.json ===
 def load_state():
-    global USER_STATE, AUTO4_STATE, AUTO_SETUP, USER_DATA, ALLOWED_USERS
+    global USER_STATE, AUTO_SETUP, USER_DATA, ALLOWED_USERS
+    legacy_jobs = []
     if os.path.exists(STATE_FILE):
         try:
             with open(STATE_FILE, "r") as f:
@@ -109,32 +135,64 @@ def load_state():
                 restored_users = data.get("user_state", {})
                 for uid, udata in restored_users.items():
                     USER_STATE[int(uid)] = udata  # Convert to int for consistency
-                AUTO4_STATE.update(data.get("auto4_state", {}))
+                FILTER_REJECTIONS.update(data.get("filter_rejections", {}))
+                HOLD_STATS.update(data.get("hold_stats", {}))
+                LATENCY_STATS.update(data.get("latency_stats", {}))
+                SHADOW_STATS.update(data.get("shadow_stats", {}))
+                DEDUP_SKIPPED.update(data.get("dedup_skipped", {}))
+                ALERTS.update(data.get("pending_alerts", {}))
+                OVERFLOW_DROPPED.update(data.get("overflow_dropped", {}))
+                DEAD_LETTERS.extend(data.get("dead_letters", []))
+                POST_MAP.update(data.get("post_map", {}))
+                for job_id in POST_MAP:
+                    index_post_map(job_id)
+                # Older saves kept batch APKs outside their job
+                legacy_batches = data.get("auto_batches", {})
+                if data.get("auto4_state", {}).get("pending_apks"):
+                    legacy_batches.setdefault("setup4", data["auto4_state"])
                 AUTO_SETUP.update(data.get("auto_setup", {}))
+                legacy_jobs = data.get("auto_jobs", [])  # before auto_jobs.json, jobs lived here
+                for job in legacy_jobs:
+                    if job.get("kind") == "batch" and not job.get("items"):
+                        job["items"] = legacy_batches.get(job["setup"], {}).get("pending_apks", [])
+                        job["window"] = f"{job['setup']}:{job['source_name']}:burst"
                 USER_DATA.update(data.get("user_data", {}))
         except json.JSONDecodeError as e:
             print(f"[ERROR] Failed to load state.json: {e}")
 
+    resume_auto_jobs(legacy_jobs)
+
     if os.path.exists("config.json"):
         with open("config.json") as f:
             config = json.load(f)
             ALLOWED_USERS = set(config.get("allowed_users", []))
 
-def save_state():
-    try:
-        # Ensure keys are saved as strings for JSON compatibility
-        serializable_user_state = {
-            str(user_id): data for user_id, data in USER_STATE.items()
-        }
+def state_json() -> str:
+    # Ensure keys are saved as strings for JSON compatibility; live session objects
+    # (e.g. the Method 2 countdown task) are not saved
+    serializable_user_state = {
+        str(user_id): {key: value for key, value in data.items() if not isinstance(value, asyncio.Task)}
+        for user_id, data in USER_STATE.items()
+    }
 
-        with open(STATE_FILE, "w") as f:
-            json.dump({
-                "user_state": serializable_user_state,
-                "auto4_state": AUTO4_STATE,
-                "auto_setup": AUTO_SETUP,
-                "user_data": USER_DATA
-            }, f, indent=4)
+    return json.dumps({
+            "user_state": serializable_user_state,
+            "filter_rejections": FILTER_REJECTIONS,
+            "hold_stats": HOLD_STATS,
+            "latency_stats": LATENCY_STATS,
+            "shadow_stats": SHADOW_STATS,
+            "dedup_skipped": DEDUP_SKIPPED,
+            "pending_alerts": ALERTS,
+            "overflow_dropped": OVERFLOW_DROPPED,
+            "dead_letters": DEAD_LETTERS,
+            "post_map": POST_MAP,
+            "auto_setup": AUTO_SETUP,
+            "user_data": USER_DATA
+        }, indent=4, default=lambda o: None)
 
+def save_state():
+    try:
+        write_file_atomic(STATE_FILE, state_json())
         print("[STATE] Saved state.json successfully.")
     except Exception as e:
         print(f"[ERROR] Failed to save state.json: {e}")
@@ -157,6 +215,7 @@ def update_user_stats(user_id: int, method: str, apks: int = 0, keys: int = 0):
         USER_STATE[user_id][f"{scope}_{method}_keys"] = USER_STATE[user_id].get(f"{scope}_{method}_keys", 0) + keys
 
 def save_config():
+    refresh_setups()
     with open("config.json", "w") as f:
         json.dump({
             "owner_id": OWNER_ID,
@@ -164,10 +223,15 @@ def save_config():
             "user_data": USER_DATA,
             "auto_setup": AUTO_SETUP,
             "bot_active": BOT_ACTIVE,
-            "bot_admin_link": BOT_ADMIN_LINK
+            "bot_admin_link": BOT_ADMIN_LINK,
+            "concurrent_updates": CONCURRENT_UPDATES,
+            "recaption_in_place": RECAPTION_IN_PLACE,
+            "album_posting": ALBUM_POSTING,
+            "alert_digest_interval": ALERT_DIGEST_INTERVAL
         }, f, indent=4)
 
 def save_auto_setup():
+    refresh_setups()
     if os.path.exists("config.json"):
         try:
             with open("config.json", "r") as f:
@@ -178,6 +242,1497 @@ def save_auto_setup():
         except Exception as e:
             print(f"[ERROR] save_auto_setup failed: {e}")
 
+def save_auto_jobs():
+    """Mark the job store changed; called on each state change of a job.
+
+    auto_jobs_writer() writes it shortly after, off the event loop, so a burst of changes
+    costs one write. Use flush_auto_jobs() where a change must be on disk before going on.
+    """
+    auto_jobs_dirty.set()
+
+def write_file_atomic(path: str, data: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)  # a crash leaves either the old file or the new one
+
+def write_auto_jobs(data: str):
+    write_file_atomic(AUTO_JOBS_FILE, data)
+
+async def flush_auto_jobs():
+    """Write the job store now if it changed since the last write."""
+    async with auto_jobs_write_lock:
+        if not auto_jobs_dirty.is_set():
+            return
+        auto_jobs_dirty.clear()
+        data = json.dumps(list(AUTO_JOBS.values()), indent=4)
+        try:
+            await asyncio.to_thread(write_auto_jobs, data)
+        except Exception as e:
+            auto_jobs_dirty.set()
+            print(f"[ERROR] Failed to save {AUTO_JOBS_FILE}: {e}")
+
+async def auto_jobs_writer():
+    while True:
+        await auto_jobs_dirty.wait()
+        await asyncio.sleep(AUTO_JOBS_FLUSH_DELAY)
+        await flush_auto_jobs()
+
+def resume_auto_jobs(legacy_jobs=()):
+    """Put jobs that were waiting or posting when the bot stopped back on the delay queue."""
+    jobs = list(legacy_jobs)
+    if os.path.exists(AUTO_JOBS_FILE):
+        try:
+            with open(AUTO_JOBS_FILE, "r") as f:
+                jobs = json.load(f)
+        except json.JSONDecodeError as e:
+            print(f"[ERROR] Failed to load {AUTO_JOBS_FILE}: {e}")
+
+    # Queued in source order, so the posting slots are too
+    for job in sorted(jobs, key=lambda j: j.get("accepted_at", 0)):
+        if job.get("started") and "status" not in job:
+            # Saved by an older build that did not record posting progress
+            print(f"[AUTO] Not resuming {job['id']}: it may already have posted.")
+            continue
+        # A job that never reached "posting" has sent nothing yet and simply runs again;
+        # a "posting" job skips the probe and only sends to destinations it never tried
+        job["started"] = False
+        job["parked"] = False  # breakers start closed; a dead destination parks the job again
+        job.setdefault("status", "pending")
+        enqueue_auto_job(job, persist=False)
+        print(f"[AUTO] Resumed {job['id']} ({job['status']}).")
+    save_auto_jobs()
+
+def enqueue_auto_job(job: dict, persist: bool = True):
+    """Push an auto-forward job onto the delay queue, ordered by its due time."""
+    global AUTO_QUEUE_SEQ
+    AUTO_QUEUE_SEQ += 1
+    job.setdefault("status", "pending")
+    AUTO_JOBS[job["id"]] = job
+    if job.get("window"):
+        AUTO_WINDOWS[job["window"]] = job["id"]
+    if job_blocked(job):
+        # Every destination is paused: skip the hold, replay_parked_jobs() queues it on recovery.
+        # Its window still collects until the job's due time (see open_window_job)
+        job["parked"] = True
+    else:
+        heapq.heappush(AUTO_QUEUE, (job["due"], AUTO_QUEUE_SEQ, job["id"]))
+        auto_queue_event.set()
+        reserve_job_posts(job)
+    if persist:
+        save_auto_jobs()
+
+async def post_auto_destinations(bot, job: dict, destinations: list, post_to):
+    """
+    Post a job to each destination at most once. Progress is on disk before the sends
+    and saved after each one, so a restart re-sends only where nothing was attempted; a
+    send that was in flight when the bot stopped is reported, never repeated.
+    A destination whose breaker is open is parked instead and posted on recovery.
+    Returns one message_id or Exception per destination.
+    """
+    posts = job.setdefault("posts", {})
+    to_send = set()
+    for dest in destinations:
+        if posts.get(dest["channel"], {}).get("state") in (None, "failed", "parked"):
+            if not job.get("shadow") and breaker_open(dest["channel"]):
+                posts[dest["channel"]] = {"state": "parked"}
+                release_uploads(job, dest, job.get("key"))
+                continue
+            posts[dest["channel"]] = {"state": "posting"}
+            to_send.add(dest["channel"])
+    for dest in destinations:
+        ticket = None if dest["channel"] in to_send else job_ticket(job, dest["channel"])
+        if ticket:
+            release_post(ticket)  # nothing to send there: later posts to the chat need not wait for this job
+    job["status"] = "posting"
+    save_auto_jobs()
+    await flush_auto_jobs()  # the "posting" marks must be on disk before anything is sent
+
+    async def send(dest):
+        record = posts[dest["channel"]]
+        if dest["channel"] not in to_send:
+            if record["state"] == "done":
+                return record["message_id"]
+            if record["state"] == "parked":
+                return DestinationParked(dest["channel"])
+            return RuntimeError("bot restarted during this post; not re-sent to avoid a duplicate")
+        try:
+            message_id = await post_to(dest)
+        except Exception as e:
+            if not job.get("shadow") and await record_destination_failure(bot, dest["channel"], e):
+                # This failure tripped the breaker: keep the post for the replay
+                posts[dest["channel"]] = {"state": "parked"}
+                save_auto_jobs()
+                return DestinationParked(dest["channel"])
+            posts[dest["channel"]] = {"state": "failed"}
+            save_auto_jobs()
+            if not job.get("shadow"):
+                dead_letter(job, dest, e)
+            return e
+        if not job.get("shadow"):
+            record_destination_success(dest["channel"])
+        posts[dest["channel"]] = {"state": "done", "message_id": message_id}
+        save_auto_jobs()
+        return message_id
+
+    return await asyncio.gather(*(send(dest) for dest in destinations))
+
+def open_window_job(window: str):
+    """The job still collecting posts for this window, or None once it has started."""
+    job = AUTO_JOBS.get(AUTO_WINDOWS.get(window))
+    # A parked job stops collecting at its due time, so an outage does not pile every post into it
+    if job and not job.get("started") and not (job.get("parked") and time.time() >= job["due"]):
+        return job
+    AUTO_WINDOWS.pop(window, None)
+    return None
+
+def close_window(job: dict):
+    if job.get("window") and AUTO_WINDOWS.get(job["window"]) == job["id"]:
+        del AUTO_WINDOWS[job["window"]]
+
+def extract_key(caption: str, entities=None, use_entities: bool = True):
+    """Find the key in a caption: "Key - xxx" first, then the first code entity (dicts)."""
+    caption = caption or ""
+    match = re.search(r'Key\s*-\s*(\S+)', caption)
+    if match:
+        return match.group(1)
+    if use_entities:
+        for entity in entities or []:
+            if entity["type"] == "code":
+                return caption[entity["offset"]:entity["offset"] + entity["length"]]
+    return None
+
+# === SETUP REGISTRY ===
+# Each pipeline is an AUTO_SETUP["setupN"] entry; its mode, filters and style decide how it runs
+SETUP_MODES = ("single", "batch")
+LEGACY_SETUP_DEFAULTS = {
+    "setup1": {"filters": {"min_size_mb": 1, "max_size_mb": 50}},
+    "setup2": {"filters": {"min_size_mb": 80, "max_size_mb": 2048}},
+    "setup4": {"mode": "batch"}
+}
+
+def new_setup(name: str = "") -> dict:
+    setup = {
+        "source_channel": "",
+        "dest_channel": "",
+        "dest_caption": "",
+        "key_mode": "auto",
+        "style": "mono",
+        "mode": "single",
+        "filters": {},
+        "extra_destinations": [],
+        "hold_min": 2,
+        "hold_max": AUTO_HOLD_SECONDS,
+        "shadow": False,
+        "max_concurrent": 3,
+        "max_queued": 20,
+        "overflow": "queue",
+        "enabled": False,
+        "completed_count": 0,
+        "processed_count": 0,
+        "last_key": ""
+    }
+    setup.update(copy.deepcopy(LEGACY_SETUP_DEFAULTS.get(name, {})))
+    return setup
+
+def normalize_setups():
+    """Add fields introduced after a setup was saved (mode, filters, ...) without touching existing ones."""
+    for name, setup in AUTO_SETUP.items():
+        for field, value in new_setup(name).items():
+            setup.setdefault(field, value)
+
+def parse_setup_number(value):
+    """"setup12", "viewsetup12", "auto12_menu", "waiting_source12" -> "12" (None if there is none)."""
+    match = re.search(r"\d+", str(value or ""))
+    return match.group(0) if match else None
+
+def setup_names() -> list:
+    return sorted(AUTO_SETUP, key=lambda name: int(parse_setup_number(name) or 0))
+
+def add_setup() -> str:
+    number = max((int(parse_setup_number(name) or 0) for name in AUTO_SETUP), default=0) + 1
+    name = f"setup{number}"
+    AUTO_SETUP[name] = new_setup(name)
+    return name
+
+def setup_destinations(setup: dict) -> list:
+    """Where a setup posts: the main destination first, then the extra ones, as {"channel", "caption"}."""
+    destinations = []
+    if setup.get("dest_channel"):
+        destinations.append({"channel": setup["dest_channel"], "caption": setup.get("dest_caption", "")})
+    for extra in setup.get("extra_destinations") or []:
+        destinations.append({"channel": extra["channel"], "caption": extra.get("caption") or setup.get("dest_caption", "")})
+    return destinations
+
+def parse_destinations(text: str) -> list:
+    """Owner input, one "channel | caption" per line (caption optional); "clear" removes all."""
+    destinations = []
+    if text.strip().lower() == "clear":
+        return destinations
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        channel, _, caption = line.partition("|")
+        channel, caption = channel.strip(), caption.strip()
+        if not (channel.startswith("@") or channel.startswith("-100")):
+            raise ValueError(f"'{channel}' must start with @username or -100...")
+        if caption and "Key -" not in caption:
+            raise ValueError(f"caption for {channel} must include 'Key -'")
+        destinations.append({"channel": channel, "caption": caption})
+    return destinations
+
+def auto_post_link(channel, message_id) -> str:
+    if str(channel).startswith("@"):
+        return f"https://t.me/{str(channel).strip('@')}/{message_id}"
+    if str(channel).startswith("-100"):
+        return f"https://t.me/c/{str(channel)[4:]}/{message_id}"
+    return "Unknown"
+
+# === SETUP FILTER RULES ===
+# setup["filters"] is compiled once per save into a chain of (rule, predicate) over an auto_job_item()
+FILTER_NUMBER_RULES = ("min_size_mb", "max_size_mb")
+FILTER_LIST_RULES = ("extensions", "mime_types", "senders")
+FILTER_REGEX_RULES = ("filename_regex", "caption_regex", "caption_exclude_regex")
+SETUP_FILTERS = {}      # setup name -> [(rule, predicate)]
+FILTER_REJECTIONS = {}  # setup name -> {rule: rejected posts} (persisted in state.json)
+
+def build_filter_chain(rules: dict) -> list:
+    """Compile filter rules into predicates; raises ValueError / re.error on bad rules."""
+    chain = []
+
+    # Without an explicit list only APKs pass, as before
+    extensions = tuple(ext.lower() for ext in rules.get("extensions") or [".apk"])
+    chain.append(("extensions", lambda item: item["file_name"].lower().endswith(extensions)))
+
+    if "min_size_mb" in rules:
+        min_bytes = float(rules["min_size_mb"]) * 1024 * 1024
+        chain.append(("min_size_mb", lambda item: item["file_size"] >= min_bytes))
+    if "max_size_mb" in rules:
+        max_bytes = float(rules["max_size_mb"]) * 1024 * 1024
+        chain.append(("max_size_mb", lambda item: item["file_size"] <= max_bytes))
+
+    if rules.get("mime_types"):
+        mime_types = {mime.lower() for mime in rules["mime_types"]}
+        chain.append(("mime_types", lambda item: (item.get("mime_type") or "").lower() in mime_types))
+
+    if rules.get("senders"):
+        senders = {str(sender).lstrip("@").lower() for sender in rules["senders"]}
+        chain.append(("senders", lambda item: str(item.get("sender") or "").lstrip("@").lower() in senders))
+
+    if rules.get("filename_regex"):
+        filename_pattern = re.compile(rules["filename_regex"], re.IGNORECASE)
+        chain.append(("filename_regex", lambda item: filename_pattern.search(item["file_name"]) is not None))
+    if rules.get("caption_regex"):
+        caption_pattern = re.compile(rules["caption_regex"], re.IGNORECASE)
+        chain.append(("caption_regex", lambda item: caption_pattern.search(item["caption"]) is not None))
+    if rules.get("caption_exclude_regex"):
+        exclude_pattern = re.compile(rules["caption_exclude_regex"], re.IGNORECASE)
+        chain.append(("caption_exclude_regex", lambda item: exclude_pattern.search(item["caption"]) is None))
+
+    return chain
+
+def compile_setup_filters():
+    SETUP_FILTERS.clear()
+    for name, setup in AUTO_SETUP.items():
+        try:
+            SETUP_FILTERS[name] = build_filter_chain(setup.get("filters") or {})
+        except (ValueError, TypeError, re.error) as e:
+            print(f"[FILTER] {name} has invalid rules, rejecting everything: {e}")
+            SETUP_FILTERS[name] = [("invalid_rules", lambda item: False)]
+
+def rejected_by(setup_name: str, item: dict):
+    """Name of the first rule the item fails (and count it), or None if it passes."""
+    for rule, accepts in SETUP_FILTERS.get(setup_name, ()):
+        if not accepts(item):
+            counts = FILTER_REJECTIONS.setdefault(setup_name, {})
+            counts[rule] = counts.get(rule, 0) + 1
+            return rule
+    return None
+
+def parse_filter_rules(text: str) -> dict:
+    """Owner input, one "rule: value" per line (lists comma separated); "clear" removes all rules."""
+    rules = {}
+    if text.strip().lower() == "clear":
+        return rules
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        rule, sep, value = line.partition(":")
+        rule, value = rule.strip().lower(), value.strip()
+        if not sep or not value:
+            raise ValueError(f"expected 'rule: value', got '{line.strip()}'")
+        if rule in FILTER_NUMBER_RULES:
+            rules[rule] = float(value)
+        elif rule in FILTER_LIST_RULES:
+            rules[rule] = [part.strip() for part in value.split(",") if part.strip()]
+        elif rule in FILTER_REGEX_RULES:
+            rules[rule] = value
+        else:
+            raise ValueError(f"unknown rule '{rule}'")
+    return rules
+
+def format_filter_rules(rules: dict) -> str:
+    lines = []
+    for rule, value in rules.items():
+        lines.append(f"{rule}: {', '.join(map(str, value)) if isinstance(value, list) else value}")
+    return "\n".join(lines) or "none (APKs only)"
+
+# === SOURCE ROUTING INDEX ===
+SOURCE_INDEX = {}  # normalized source chat ("-100..." or "@name" lowercased) -> setup name
+SHADOW_INDEX = {}  # normalized source chat -> setups running in shadow mode on it
+DISABLED_INDEX = {}  # normalized source chat -> a switched-off setup on it (only for the owner digest)
+
+def normalize_source(source) -> str:
+    source = str(source or "").strip()
+    return source.lower() if source.startswith("@") else source
+
+def rebuild_source_index():
+    """Recompute SOURCE_INDEX from the enabled setups. Batch setups win a shared source, then the lowest number.
+    Shadow setups never win a source; every one of them is listed in SHADOW_INDEX instead."""
+    index = {}
+    shadow = {}
+    disabled = {}
+    for name in sorted(AUTO_SETUP, key=lambda n: (AUTO_SETUP[n].get("mode") != "batch", int(parse_setup_number(n) or 0))):
+        setup = AUTO_SETUP[name]
+        source = normalize_source(setup.get("source_channel"))
+        if not source:
+            continue
+        if setup.get("shadow"):
+            shadow.setdefault(source, []).append(name)
+        elif setup.get("enabled"):
+            index.setdefault(source, name)
+        else:
+            disabled.setdefault(source, name)
+    SOURCE_INDEX.clear()
+    SOURCE_INDEX.update(index)
+    SHADOW_INDEX.clear()
+    SHADOW_INDEX.update(shadow)
+    DISABLED_INDEX.clear()
+    DISABLED_INDEX.update(disabled)
+
+def refresh_setups():
+    """Rebuild everything derived from AUTO_SETUP; runs on startup and on every save."""
+    rebuild_source_index()
+    compile_setup_filters()
+
+def route_source(chat):
+    """Setup name for a source chat, or None."""
+    setup_name = SOURCE_INDEX.get(str(chat.id))
+    if setup_name is None and chat.username:
+        setup_name = SOURCE_INDEX.get(f"@{chat.username.lower()}")
+    return setup_name
+
+def shadow_routes(chat) -> list:
+    """Shadow setups listening to a source chat."""
+    names = list(SHADOW_INDEX.get(str(chat.id), []))
+    if chat.username:
+        names += SHADOW_INDEX.get(f"@{chat.username.lower()}", [])
+    return names
+
+class SourceChatFilter(filters.MessageFilter):
+    """Passes only posts from a chat a setup listens to, so other channel traffic never reaches a handler."""
+
+    def filter(self, message) -> bool:
+        return route_source(message.chat) is not None or bool(shadow_routes(message.chat))
+
+class DisabledSourceFilter(filters.MessageFilter):
+    """Passes only posts from the source chat of a switched-off setup."""
+
+    def filter(self, message) -> bool:
+        chat = message.chat
+        return str(chat.id) in DISABLED_INDEX or bool(chat.username and f"@{chat.username.lower()}" in DISABLED_INDEX)
+
+def get_lock(registry: dict, key) -> asyncio.Lock:
+    lock = registry.get(key)
+    if lock is None:
+        lock = registry[key] = asyncio.Lock()
+    return lock
+
+def per_chat(handler):
+    """Run a handler under its chat's lock: one chat stays in order, different chats run in parallel.
+
+    Private chats use the per-user lock so background tasks touching the same session can share it.
+    A handler takes one of the CONCURRENT_UPDATES slots only once it holds the lock, so updates
+    queued behind a busy chat wait without a slot and never hold up other chats.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        if chat and chat.type == "private":
+            lock = get_lock(USER_LOCKS, chat.id)
+        elif chat:
+            lock = get_lock(CHAT_LOCKS, chat.id)
+        elif update.effective_user:
+            lock = get_lock(USER_LOCKS, update.effective_user.id)
+        else:
+            async with UPDATE_SLOTS:
+                return await handler(update, context)
+
+        async with lock:
+            async with UPDATE_SLOTS:
+                return await handler(update, context)
+
+    return wrapper
+
+# === OUTBOUND RATE LIMITER ===
+# (messages, seconds, burst) per bucket, roughly Telegram's documented flood limits
+RATE_LIMITS = {
+    "global": (30, 1, 30),   # whole bot: ~30 msg/s
+    "private": (1, 1, 3),    # one private chat: ~1 msg/s
+    "group": (20, 60, 5)     # one channel/group: ~20 msg/min
+}
+RATE_LIMIT_MAX_RETRIES = 3
+CHAT_LIMITED_PREFIXES = ("send", "forward", "copy", "edit")
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Token buckets in front of every Bot API call: one global bucket plus one per target chat.
+
+    A RetryAfter from Telegram pauses only the bucket the request was charged to and the
+    request is retried here, so handlers never see flood-waits.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _bucket(self, key, kind: str) -> dict:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            count, period, burst = RATE_LIMITS[kind]
+            bucket = self.buckets[key] = {
+                "rate": count / period,
+                "capacity": burst,
+                "tokens": burst,
+                "updated": time.monotonic(),
+                "paused_until": 0,
+                "lock": asyncio.Lock()
+            }
+        return bucket
+
+    async def _take(self, bucket: dict, cost: int = 1):
+        # The lock makes waiters on one bucket queue up in arrival order
+        async with bucket["lock"]:
+            while True:
+                now = time.monotonic()
+                if now < bucket["paused_until"]:
+                    await asyncio.sleep(bucket["paused_until"] - now)
+                    continue
+                bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+                bucket["updated"] = now
+                if bucket["tokens"] >= min(cost, bucket["capacity"]):
+                    bucket["tokens"] -= cost
+                    return
+                await asyncio.sleep((min(cost, bucket["capacity"]) - bucket["tokens"]) / bucket["rate"])
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        cost = len(data.get("media") or []) or 1
+        chat_bucket = None
+        if chat_id is not None and endpoint.startswith(CHAT_LIMITED_PREFIXES):
+            kind = "group" if str(chat_id).startswith(("-", "@")) else "private"
+            chat_bucket = self._bucket(str(chat_id), kind)
+        global_bucket = self._bucket("global", "global")
+
+        for attempt in range(RATE_LIMIT_MAX_RETRIES + 1):
+            if chat_bucket:
+                await self._take(chat_bucket, cost)
+            await self._take(global_bucket, cost)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= RATE_LIMIT_MAX_RETRIES:
+                    raise
+                paused = chat_bucket or global_bucket
+                paused["paused_until"] = time.monotonic() + e.retry_after
+                print(f"[RATE] {endpoint} -> {chat_id}: flood wait {e.retry_after}s (attempt {attempt + 1})")
+
+# === DESTINATION POSTING QUEUES ===
+# One FIFO worker per destination chat: posts to a chat go out strictly one after another,
+# in the order their slots were reserved, while different chats post in parallel
+POST_QUEUES = {}             # chat id -> {"tickets": deque, "event": Event, "task": Task}
+JOB_TICKETS = {}             # auto job id -> {channel: ticket} reserved when the job was queued
+POST_TICKET_TIMEOUT = 300    # a reserved slot nobody filled is skipped this long after it was expected (s)
+POST_WORKER_IDLE = 60        # an idle chat worker exits after this long (s)
+
+def reserve_post(chat_id, ready_in: float = 0) -> dict:
+    """Take the next place in a chat's posting order; fill it with deliver_post() or give it back with release_post().
+
+    ready_in is how long the place may stay empty before POST_TICKET_TIMEOUT starts counting.
+    """
+    key = str(chat_id)
+    queue = POST_QUEUES.get(key)
+    if queue is None:
+        queue = POST_QUEUES[key] = {"tickets": deque(), "event": asyncio.Event(), "task": None}
+    ticket = {
+        "chat": key,
+        "send": None,
+        "future": asyncio.get_running_loop().create_future(),
+        "released": False,
+        "expected_at": time.monotonic() + ready_in
+    }
+    queue["tickets"].append(ticket)
+    if queue["task"] is None or queue["task"].done():
+        queue["task"] = asyncio.create_task(post_queue_worker(key))
+    return ticket
+
+def release_post(ticket: dict):
+    """Give back a reserved place that will not be used, so later posts to the chat are not held up."""
+    if ticket["send"] is None:
+        ticket["released"] = True
+        queue = POST_QUEUES.get(ticket["chat"])
+        if queue:
+            queue["event"].set()
+
+async def deliver_post(chat_id, send, ticket: dict = None):
+    """Run send() (an async callable doing the Bot API calls) in the chat's posting order.
+
+    Without a ticket the post joins the end of the queue. Returns send()'s result or raises its error.
+    """
+    if ticket is None or ticket["released"]:
+        ticket = reserve_post(chat_id)
+    ticket["send"] = send
+    POST_QUEUES[ticket["chat"]]["event"].set()
+    return await ticket["future"]
+
+def post_queue_key(job: dict, channel):
+    """Shadow jobs only record their posts, in queues of their own, so live posts never hold them up."""
+    return f"shadow:{channel}" if job.get("shadow") else channel
+
+def job_ticket(job: dict, channel):
+    """The slot an auto job reserved for a channel when it was queued (None if it has none)."""
+    return JOB_TICKETS.get(job["id"], {}).pop(channel, None)
+
+def reserve_job_posts(job: dict):
+    """Reserve a slot in every destination's queue, so the job posts after the jobs its source sent before it,
+    whatever their holds. Released when the job ends (run_auto_job) or parks."""
+    if job.get("shadow") or job["id"] in JOB_TICKETS:
+        return
+    setup = AUTO_SETUP.get(job["setup"], {})
+    ready_in = max(0, job["due"] - time.time())
+    JOB_TICKETS[job["id"]] = {dest["channel"]: reserve_post(dest["channel"], ready_in) for dest in setup_destinations(setup)}
+
+def release_job_posts(job: dict):
+    for ticket in JOB_TICKETS.pop(job["id"], {}).values():
+        release_post(ticket)
+
+async def post_queue_worker(key: str):
+    queue = POST_QUEUES[key]
+    tickets = queue["tickets"]
+    while True:
+        while tickets:
+            head = tickets[0]
+            if head["released"]:
+                tickets.popleft()
+                continue
+            if head["send"] is None:
+                # The next post in order is not ready yet: everything behind it waits
+                waited = time.monotonic() - head["expected_at"]
+                if waited >= POST_TICKET_TIMEOUT:
+                    print(f"[POSTQ] {key}: reserved slot unused for {int(waited)}s, skipping it")
+                    head["released"] = True
+                    continue
+                queue["event"].clear()
+                try:
+                    await asyncio.wait_for(queue["event"].wait(), timeout=POST_TICKET_TIMEOUT - waited)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            tickets.popleft()
+            try:
+                result = await head["send"]()
+            except Exception as e:
+                if not head["future"].done():
+                    head["future"].set_exception(e)
+            else:
+                if not head["future"].done():
+                    head["future"].set_result(result)
+
+        queue["event"].clear()
+        try:
+            await asyncio.wait_for(queue["event"].wait(), timeout=POST_WORKER_IDLE)
+        except asyncio.TimeoutError:
+            if not tickets:
+                POST_QUEUES.pop(key, None)
+                return
+
+# === PROGRESS TICKER ===
+# One task refreshes every live countdown/progress message instead of each UI editing once a second
+PROGRESS_MESSAGES = {}        # (chat_id, message_id) -> entry, see track_progress()
+PROGRESS_TICK = 1             # how often the ticker wakes up (s)
+PROGRESS_MIN_EDIT_GAP = 5     # min seconds between two edits of the same message
+PROGRESS_BATCH_SIZE = 10      # live messages per gap; more than this stretches the gap
+progress_event = asyncio.Event()
+
+def track_progress(chat_id, message_id, render, deadline: float, parse_mode: str = "HTML", reply_markup=None, text: str = None):
+    """Hand a sent message to the ticker. render(now) returns its current text; tracking stops at deadline."""
+    PROGRESS_MESSAGES[(chat_id, message_id)] = {
+        "render": render,
+        "deadline": deadline,
+        "parse_mode": parse_mode,
+        "reply_markup": reply_markup,
+        "text": text,
+        "edited_at": time.time()
+    }
+    progress_event.set()
+
+def untrack_progress(chat_id, message_id):
+    PROGRESS_MESSAGES.pop((chat_id, message_id), None)
+
+async def progress_ticker(bot):
+    while True:
+        if not PROGRESS_MESSAGES:
+            progress_event.clear()
+            await progress_event.wait()
+            continue
+
+        now = time.time()
+        gap = PROGRESS_MIN_EDIT_GAP * max(1, math.ceil(len(PROGRESS_MESSAGES) / PROGRESS_BATCH_SIZE))
+        edits = []
+        for key, entry in list(PROGRESS_MESSAGES.items()):
+            if now >= entry["deadline"]:
+                # The owner of the message writes its final state
+                PROGRESS_MESSAGES.pop(key, None)
+                continue
+            if now - entry["edited_at"] < gap:
+                continue
+            try:
+                text = entry["render"](now)
+            except Exception as e:
+                print(f"[PROGRESS] Render failed for {key}: {e}")
+                PROGRESS_MESSAGES.pop(key, None)
+                continue
+            if text == entry["text"]:
+                continue
+            entry["text"] = text
+            entry["edited_at"] = now
+            edits.append(bot.edit_message_text(
+                chat_id=key[0],
+                message_id=key[1],
+                text=text,
+                parse_mode=entry["parse_mode"],
+                reply_markup=entry["reply_markup"]
+            ))
+
+        if edits:
+            results = await asyncio.gather(*edits, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception) and "not modified" not in str(result):
+                    print(f"[PROGRESS] Edit failed: {result}")
+
+        await asyncio.sleep(PROGRESS_TICK)
+
+# === LIVENESS PROBE ===
+# Source posts due in the same tick are checked together: one forwardMessages call per source chat
+# (up to 100 ids), split only when some ids are missing, then one deleteMessages clears the copies.
+PROBE_TICK = 0.5          # probes asked for within this window share one round
+PROBE_BATCH_SIZE = 100    # Bot API limit for forwardMessages / deleteMessages
+PROBE_CONCURRENCY = 4     # probe requests in flight at once
+PROBE_PENDING = {}        # (chat_id, message_id) -> Future[bool] waiting for the next round
+probe_semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+async def messages_exist(bot, items: list) -> list:
+    """For each {"chat_id", "message_id"} item, whether the source post still exists."""
+    loop = asyncio.get_running_loop()
+    start_round = not PROBE_PENDING
+    futures = []
+    for item in items:
+        key = (item["chat_id"], item["message_id"])
+        if key not in PROBE_PENDING:
+            PROBE_PENDING[key] = loop.create_future()
+        futures.append(PROBE_PENDING[key])
+    if futures and start_round:
+        loop.create_task(probe_round(bot))
+    return list(await asyncio.gather(*futures))
+
+async def probe_round(bot):
+    await asyncio.sleep(PROBE_TICK)
+    pending = dict(PROBE_PENDING)
+    PROBE_PENDING.clear()
+
+    by_chat = {}
+    for chat_id, message_id in pending:
+        by_chat.setdefault(chat_id, []).append(message_id)
+    chunks = [
+        (chat_id, ids[i:i + PROBE_BATCH_SIZE])
+        for chat_id, ids in by_chat.items()
+        for i in range(0, len(ids), PROBE_BATCH_SIZE)
+    ]
+
+    copies = []
+    results = await asyncio.gather(*(probe_chunk(bot, chat_id, ids, copies) for chat_id, ids in chunks), return_exceptions=True)
+    alive = set()
+    for (chat_id, _), result in zip(chunks, results):
+        if isinstance(result, Exception):
+            print(f"[PROBE] {chat_id}: {result}")  # treated as deleted, like a failed forward
+            continue
+        alive.update((chat_id, message_id) for message_id in result)
+
+    for key, future in pending.items():
+        if not future.done():
+            future.set_result(key in alive)
+    print(f"[PROBE] {len(alive)}/{len(pending)} posts alive, {len(chunks)} chunks")
+
+    await clear_probe_copies(bot, copies)
+
+async def probe_chunk(bot, chat_id, message_ids: list, copies: list) -> set:
+    """Ids of this chunk that still exist. The chunk is halved only when some ids are missing."""
+    if len(message_ids) == 1:
+        async with probe_semaphore:
+            try:
+                sent = await bot.forward_message(
+                    chat_id=OWNER_ID, from_chat_id=chat_id, message_id=message_ids[0], disable_notification=True
+                )
+            except Exception:
+                return set()
+        copies.append(sent.message_id)
+        return set(message_ids)
+
+    async with probe_semaphore:
+        try:
+            # python-telegram-bot 20.3 has no forward_messages(); forwardMessages skips missing ids
+            sent = await bot._post("forwardMessages", {
+                "chat_id": OWNER_ID,
+                "from_chat_id": chat_id,
+                "message_ids": message_ids,
+                "disable_notification": True
+            })
+        except BadRequest as e:
+            if "not found" in str(e).lower():
+                return set()
+            sent = None
+        except Exception:
+            sent = None
+
+    if sent is not None:
+        copies.extend(m["message_id"] for m in sent)
+        if len(sent) == len(message_ids):
+            return set(message_ids)
+        if not sent:
+            return set()
+
+    half = len(message_ids) // 2
+    left, right = await asyncio.gather(
+        probe_chunk(bot, chat_id, message_ids[:half], copies),
+        probe_chunk(bot, chat_id, message_ids[half:], copies)
+    )
+    return left | right
+
+async def clear_probe_copies(bot, message_ids: list):
+    for i in range(0, len(message_ids), PROBE_BATCH_SIZE):
+        try:
+            await bot._post("deleteMessages", {"chat_id": OWNER_ID, "message_ids": message_ids[i:i + PROBE_BATCH_SIZE]})
+        except Exception as e:
+            print(f"[PROBE] Could not delete probe copies: {e}")
+
+# === ADAPTIVE HOLD ===
+# Each setup learns how often and how fast its source deletes posts, and holds new posts for about
+# as long as deletions take: near hold_min for sources that never delete, hold_max for risky ones.
+HOLD_STATS = {}           # setup name -> {"posts", "deleted", "delays"} (persisted in state.json)
+HOLD_DECAY = 0.98         # weight kept by older posts per new watched post (~50 posts of memory)
+HOLD_LEARN_POSTS = 10     # hold_max until this many posts have been seen
+HOLD_RISKY_RATE = 0.2     # deleting this share of posts keeps hold_max
+HOLD_DELAY_SAMPLES = 50   # recent deletion delays kept per setup
+HOLD_WATCH_SHARE = 0.2    # share of jobs whose deletions are watched once a setup has learned
+
+def record_deletions(setup_name: str, posts: int, deleted: int, delay: float = None):
+    """Add posts seen and how many of them were deleted, each deletion at most `delay` s after posting."""
+    stats = HOLD_STATS.setdefault(setup_name, {"posts": 0, "deleted": 0, "delays": []})
+    fade = HOLD_DECAY ** posts
+    stats["posts"] = round(stats["posts"] * fade + posts, 3)
+    stats["deleted"] = round(stats["deleted"] * fade + deleted, 3)
+    if deleted and delay is not None:
+        stats["delays"] = (stats["delays"] + [round(delay, 1)] * deleted)[-HOLD_DELAY_SAMPLES:]
+
+def auto_hold_seconds(setup_name: str) -> float:
+    setup = AUTO_SETUP.get(setup_name, {})
+    hold_min = setup.get("hold_min", 2)
+    hold_max = setup.get("hold_max", AUTO_HOLD_SECONDS)
+    stats = HOLD_STATS.get(setup_name)
+    if not stats or stats["posts"] < HOLD_LEARN_POSTS:
+        return hold_max
+    if stats["deleted"] / stats["posts"] >= HOLD_RISKY_RATE:
+        return hold_max
+    if stats["deleted"] < 0.5 or not stats["delays"]:
+        return hold_min  # no deletion in recent memory
+    delays = sorted(stats["delays"])
+    p95 = delays[min(len(delays) - 1, int(len(delays) * 0.95))]
+    return max(hold_min, min(hold_max, p95 + 1))
+
+async def check_source_posts(bot, job: dict) -> list:
+    """Items of the job whose source post still exists."""
+    alive = await messages_exist(bot, job["items"])
+    return [item for item, ok in zip(job["items"], alive) if ok]
+
+def should_watch_deletions(setup_name: str) -> bool:
+    """Every job while a setup is learning, then a random sample: the rates and delays stay
+    representative at a fraction of the probe traffic."""
+    stats = HOLD_STATS.get(setup_name)
+    if not stats or stats["posts"] < HOLD_LEARN_POSTS:
+        return True
+    return random.random() < HOLD_WATCH_SHARE
+
+async def watch_deletions(bot, job: dict):
+    """Feed the setup's deletion stats from a job's source posts, independently of its hold.
+
+    The posts are probed hold_min after intake, then at doubling delays up to hold_max. A
+    deletion counts at the first probe that missed the post, so the learned delays stay within
+    a factor of two of the real ones, however long the job itself held.
+    """
+    setup = AUTO_SETUP.get(job["setup"], {})
+    hold_max = setup.get("hold_max", AUTO_HOLD_SECONDS)
+    at = min(hold_max, max(1, setup.get("hold_min", 2)))
+    gone = set()
+    try:
+        while True:
+            await asyncio.sleep(max(0, job["accepted_at"] + at - time.time()))
+            items = [item for item in job["items"] if (item["chat_id"], item["message_id"]) not in gone]
+            if not items:
+                break
+            alive = await messages_exist(bot, items)
+            gone.update((item["chat_id"], item["message_id"]) for item, ok in zip(items, alive) if not ok)
+            if not all(alive):
+                record_deletions(job["setup"], 0, alive.count(False), at)
+            if at >= hold_max:
+                break
+            at = min(hold_max, at * 2)
+        record_deletions(job["setup"], len(job["items"]), 0)
+    except Exception as e:
+        print(f"[HOLD] Deletion watch failed for {job['id']}: {e}")
+
+def parse_hold_bounds(text: str) -> tuple:
+    """Owner input "min-max" in seconds, e.g. "2-20"."""
+    numbers = re.findall(r"\d+(?:\.\d+)?", text)
+    if len(numbers) != 2:
+        raise ValueError("send two numbers, e.g. 2-20")
+    hold_min, hold_max = (float(n) for n in numbers)
+    if hold_min > hold_max or hold_max > 600:
+        raise ValueError("min must be <= max, and max at most 600 s")
+    return hold_min, hold_max
+
+# === PIPELINE LATENCY ===
+# Per-setup histograms of each auto-forward stage; state.json keeps them (autosave every 60 s)
+LATENCY_STAGES = ("hold", "slot", "probe", "key", "send", "total")
+LATENCY_BUCKETS = [round(0.05 * 1.25 ** i, 2) for i in range(43)]  # upper bounds, 0.05 s .. ~700 s
+LATENCY_STATS = {}  # setup name -> {stage: counts per bucket, last one = above the top bucket}
+
+def latency_name(job: dict) -> str:
+    """Shadow runs get their own histograms so they never mix with live numbers."""
+    return f"{job['setup']}_shadow" if job.get("shadow") else job["setup"]
+
+def record_latency(setup_name: str, stage: str, seconds: float):
+    hist = LATENCY_STATS.setdefault(setup_name, {}).setdefault(stage, [0] * (len(LATENCY_BUCKETS) + 1))
+    hist[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+def latency_percentile(hist: list, q: float):
+    """Upper bound of the bucket holding the q-th quantile, or None for an empty histogram."""
+    total = sum(hist)
+    if not total:
+        return None
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= q * total:
+            return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else math.inf
+    return math.inf
+
+def format_latency_report(setup_name: str) -> str:
+    def fmt(value):
+        if value is None:
+            return "—"
+        if value == math.inf:
+            return f">{LATENCY_BUCKETS[-1]:g}s"
+        return f"{value:g}s"
+
+    stages = LATENCY_STATS.get(setup_name, {})
+    title = "SHADOW LATENCY" if setup_name.endswith("_shadow") else "LATENCY"
+    lines = [f"┌──── AUTO {parse_setup_number(setup_name)} {title} ─────┐", "│ STAGE    p50     p95     p99     n"]
+    for stage in LATENCY_STAGES:
+        hist = stages.get(stage, [])
+        lines.append(
+            f"│ {stage:<7}  {fmt(latency_percentile(hist, 0.5)):<6}  {fmt(latency_percentile(hist, 0.95)):<6}  "
+            f"{fmt(latency_percentile(hist, 0.99)):<6}  {sum(hist)}"
+        )
+    lines.append("└──────── END OF REPORT ────────┘")
+    return "\n".join(lines)
+
+# === SHADOW MODE ===
+# A setup in shadow mode runs the full auto path on live posts but only records what it would post
+SHADOW_STATS = {}    # setup name -> counters and recent would-be posts (persisted in state.json)
+SHADOW_RECENT = 5    # would-be posts kept per setup for the report
+
+class ShadowBot:
+    """Bot stand-in for shadow jobs: posting calls are recorded, everything else reaches Telegram."""
+
+    def __init__(self, bot, job: dict):
+        self._bot = bot
+        self._job = job
+
+    def __getattr__(self, name):
+        return getattr(self._bot, name)
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        record_shadow_post(self._job, chat_id, 1, caption)
+        return SimpleNamespace(chat_id=chat_id, message_id=0)
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        record_shadow_post(self._job, chat_id, len(media), media[0].caption)
+        return [SimpleNamespace(chat_id=chat_id, message_id=0) for _ in media]
+
+def shadow_stats(setup_name: str) -> dict:
+    return SHADOW_STATS.setdefault(setup_name, {
+        "since": time.time(), "jobs": 0, "posted": 0, "declined": 0, "posts": 0, "files": 0, "recent": []
+    })
+
+def record_shadow_post(job: dict, chat_id, files: int, caption: str):
+    stats = shadow_stats(job["setup"])
+    stats["posts"] += 1
+    stats["files"] += files
+    stats["recent"] = (stats["recent"] + [{
+        "at": time.time(), "dest": str(chat_id), "files": files, "caption": caption or ""
+    }])[-SHADOW_RECENT:]
+
+def format_shadow_report(setup_name: str) -> str:
+    stats = SHADOW_STATS.get(setup_name)
+    if not stats:
+        return f"Auto {parse_setup_number(setup_name)}: no shadow traffic yet."
+    hours = max(time.time() - stats["since"], 1) / 3600
+    lines = [
+        f"┌──── AUTO {parse_setup_number(setup_name)} SHADOW RUN ─────┐",
+        f"│ SINCE         >>  {datetime.fromtimestamp(stats['since'], ZoneInfo('Asia/Kolkata')).strftime('%d-%m %H:%M')}",
+        f"│ JOBS          >>  {stats['jobs']} ({stats['posted']} posted, {stats['declined']} declined)",
+        f"│ WOULD POST    >>  {stats['posts']} posts, {stats['files']} files",
+        f"│ THROUGHPUT    >>  {stats['jobs'] / hours:.1f} jobs/h, {stats['files'] / hours:.1f} files/h",
+    ]
+    for post in stats["recent"][::-1]:
+        caption = " ".join(post["caption"].split())
+        lines.append(f"│ → {post['dest']} ×{post['files']}  {caption[:40]}")
+    lines.append("└──────── END OF REPORT ────────┘")
+    return "\n".join(lines) + "\n" + format_latency_report(f"{setup_name}_shadow")
+
+# === DUPLICATE SUPPRESSION ===
+# One APK (file_unique_id) with one key reaches a destination once per DEDUP_TTL, whichever source
+# or setup it came through. Entries share one TTL, so insertion order is also expiry order.
+DEDUP_TTL = 30 * 60           # seconds an upload blocks its copies
+DEDUP_MAX_ENTRIES = 5000      # beyond this the oldest entries go first
+DEDUP_INDEX = OrderedDict()   # (destination, file_unique_id, key) -> expires_at
+DEDUP_SKIPPED = {}            # setup name or "method2" -> duplicate files skipped (persisted in state.json)
+
+def dedup_claim(destination, file_unique_id, key) -> bool:
+    """Reserve an upload. False if this file with this key went to the destination recently."""
+    if not file_unique_id:
+        return True
+    now = time.time()
+    while DEDUP_INDEX:
+        oldest = next(iter(DEDUP_INDEX))
+        if DEDUP_INDEX[oldest] > now and len(DEDUP_INDEX) < DEDUP_MAX_ENTRIES:
+            break
+        DEDUP_INDEX.popitem(last=False)
+    entry = (str(destination), file_unique_id, key or "")
+    if entry in DEDUP_INDEX:
+        return False
+    DEDUP_INDEX[entry] = now + DEDUP_TTL
+    return True
+
+def dedup_release(destination, file_unique_id, key):
+    """Drop the claim of an upload that failed, so a later copy can still go out."""
+    DEDUP_INDEX.pop((str(destination), file_unique_id, key or ""), None)
+
+def count_duplicates(name: str, files: int):
+    if files:
+        DEDUP_SKIPPED[name] = DEDUP_SKIPPED.get(name, 0) + files
+
+def claim_uploads(job: dict, destinations: list, items: list, key: str) -> tuple:
+    """Split destinations into (to_post, duplicates). Each to_post dest gets "items": the files it has not had recently."""
+    prefix = "shadow:" if job.get("shadow") else ""  # shadow runs never block live posts
+    to_post, duplicates = [], []
+    posts = job.get("posts") or {}
+    for dest in destinations:
+        if posts.get(dest["channel"], {}).get("state") not in (None, "failed", "parked"):
+            # Already posted (or in flight) by this very job before a park or restart: nothing to claim
+            dest["items"] = []
+            to_post.append(dest)
+            continue
+        dest["items"] = [item for item in items if dedup_claim(prefix + str(dest["channel"]), item.get("file_unique_id"), key)]
+        if not job.get("shadow"):
+            count_duplicates(job["setup"], len(items) - len(dest["items"]))
+        (to_post if dest["items"] else duplicates).append(dest)
+    return to_post, duplicates
+
+def release_uploads(job: dict, dest: dict, key: str):
+    prefix = "shadow:" if job.get("shadow") else ""
+    for item in dest["items"]:
+        dedup_release(prefix + str(dest["channel"]), item.get("file_unique_id"), key)
+
+# === DESTINATION CIRCUIT BREAKERS ===
+# After BREAKER_THRESHOLD failures in a row a destination is paused: jobs for it are parked
+# (kept in AUTO_JOBS) instead of running, and breaker_monitor() checks it with growing backoff.
+BREAKERS = {}               # channel -> {"failures", "open", "retry_at", "backoff", "error"}
+BREAKER_THRESHOLD = 3       # consecutive failed sends that open a breaker
+BREAKER_BACKOFF = 60        # first recovery check after this many seconds, doubled per failed check
+BREAKER_MAX_BACKOFF = 3600
+BREAKER_TICK = 5            # how often the monitor looks for due checks
+
+class DestinationParked(Exception):
+    def __init__(self, channel):
+        super().__init__(f"{channel} is paused; the post waits for it to recover")
+
+def breaker_open(channel) -> bool:
+    return BREAKERS.get(str(channel), {}).get("open", False)
+
+def record_destination_success(channel):
+    breaker = BREAKERS.get(str(channel))
+    if breaker and not breaker["open"]:
+        breaker["failures"] = 0
+
+DESTINATION_BAD_REQUESTS = ("chat not found", "not enough rights", "chat_write_forbidden", "have no rights")
+
+def is_destination_error(error: Exception) -> bool:
+    """A failure of the channel itself (access lost, chat gone, network), not of one file or caption."""
+    if isinstance(error, (Forbidden, ChatMigrated)):
+        return True
+    if isinstance(error, BadRequest):
+        return any(text in str(error).lower() for text in DESTINATION_BAD_REQUESTS)
+    return isinstance(error, (TimedOut, NetworkError, RetryAfter, asyncio.TimeoutError, ConnectionError))
+
+async def record_destination_failure(bot, channel, error: Exception) -> bool:
+    """Count a failed send; True when the breaker is (now) open."""
+    if not is_destination_error(error):
+        return breaker_open(channel)  # e.g. a file too big or a bad caption: the channel is fine
+    breaker = BREAKERS.setdefault(str(channel), {"failures": 0, "open": False, "retry_at": 0, "backoff": BREAKER_BACKOFF, "error": ""})
+    if breaker["open"]:
+        return True
+    breaker["failures"] += 1
+    breaker["error"] = str(error)
+    if breaker["failures"] < BREAKER_THRESHOLD:
+        return False
+
+    breaker["open"] = True
+    breaker["backoff"] = BREAKER_BACKOFF
+    breaker["retry_at"] = time.time() + BREAKER_BACKOFF
+    print(f"[BREAKER] {channel} opened after {breaker['failures']} failures: {error}")
+    try:
+        await bot.send_message(
+            chat_id=OWNER_ID,
+            text=(
+                f"🔌 <b>Destination paused:</b> <code>{escape(str(channel))}</code>\n"
+                f"➔ {breaker['failures']} failed posts in a row, last: <code>{escape(str(error))}</code>\n"
+                f"➔ New jobs are parked. Checking again in {BREAKER_BACKOFF}s."
+            ),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        print(f"[BREAKER] Owner alert failed: {e}")
+    return True
+
+def job_blocked(job: dict) -> bool:
+    """True while a job has nothing to post to but paused destinations."""
+    if job.get("shadow"):
+        return False
+    parked = [channel for channel, record in (job.get("posts") or {}).items() if record.get("state") == "parked"]
+    if parked:
+        return any(breaker_open(channel) for channel in parked)
+    channels = [dest["channel"] for dest in setup_destinations(AUTO_SETUP.get(job["setup"], {}))]
+    return bool(channels) and all(breaker_open(channel) for channel in channels)
+
+async def destination_healthy(bot, channel) -> bool:
+    """Cheap recovery check: is the bot still an admin that may post there?"""
+    try:
+        member = await bot.get_chat_member(chat_id=channel, user_id=bot.id)
+    except Exception as e:
+        print(f"[BREAKER] {channel} still unhealthy: {e}")
+        return False
+    if member.status == "creator":
+        return True
+    return member.status == "administrator" and getattr(member, "can_post_messages", True) is not False
+
+def replay_parked_jobs() -> int:
+    replayed = 0
+    for job in list(AUTO_JOBS.values()):
+        if job.get("parked") and not job_blocked(job):
+            job["parked"] = False
+            job["started"] = False
+            job["due"] = time.time()
+            enqueue_auto_job(job)
+            replayed += 1
+    return replayed
+
+async def breaker_monitor(bot):
+    while True:
+        await asyncio.sleep(BREAKER_TICK)
+        for channel, breaker in list(BREAKERS.items()):
+            if not breaker["open"] or time.time() < breaker["retry_at"]:
+                continue
+            try:
+                if not await destination_healthy(bot, channel):
+                    breaker["backoff"] = min(breaker["backoff"] * 2, BREAKER_MAX_BACKOFF)
+                    breaker["retry_at"] = time.time() + breaker["backoff"]
+                    continue
+
+                BREAKERS.pop(channel, None)
+                replayed = replay_parked_jobs()
+                print(f"[BREAKER] {channel} recovered, replaying {replayed} job(s)")
+                await bot.send_message(
+                    chat_id=OWNER_ID,
+                    text=f"🔌 <b>Destination back:</b> <code>{escape(channel)}</code>\n➔ Replaying {replayed} parked job(s).",
+                    parse_mode="HTML"
+                )
+            except Exception as e:
+                print(f"[BREAKER] Check failed for {channel}: {e}")
+
+# === SEND RETRIES AND DEAD LETTERS ===
+# Auto posts retry transient errors (timeouts, flood waits, connection trouble) with exponential
+# backoff and jitter. Anything that still fails, or fails permanently (chat not found, not an
+# admin, ...), is kept in DEAD_LETTERS for the owner to replay from the settings panel.
+SEND_RETRY_ATTEMPTS = 4     # tries per send, the first included
+SEND_RETRY_BASE = 2         # backoff before the 2nd try (s), doubled for every later one
+SEND_RETRY_MAX = 60
+DEAD_LETTERS = []           # failed auto posts, oldest first (persisted in state.json)
+DEAD_LETTER_MAX = 200
+
+def is_transient_error(error: Exception) -> bool:
+    # BadRequest is a NetworkError subclass, so permanent errors are ruled out first
+    if isinstance(error, (BadRequest, Forbidden, ChatMigrated)):
+        return False
+    return isinstance(error, (TimedOut, NetworkError, RetryAfter, asyncio.TimeoutError, ConnectionError))
+
+async def send_with_retry(send, label):
+    """Await send() until it succeeds, retrying transient errors; the last error is raised."""
+    for attempt in range(1, SEND_RETRY_ATTEMPTS + 1):
+        try:
+            return await send()
+        except Exception as e:
+            if attempt == SEND_RETRY_ATTEMPTS or not is_transient_error(e):
+                raise
+            backoff = min(SEND_RETRY_MAX, SEND_RETRY_BASE * 2 ** (attempt - 1))
+            delay = random.uniform(backoff / 2, backoff)
+            if isinstance(e, RetryAfter):
+                delay = max(delay, e.retry_after)
+            print(f"[RETRY] {label}: {e} (try {attempt}/{SEND_RETRY_ATTEMPTS}), again in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def dead_letter(job: dict, dest: dict, error: Exception):
+    """Keep the files a destination did not get, with their captions, for a later replay."""
+    done = len(dest.get("sent") or [])
+    file_ids = (dest.get("file_ids") or [])[done:]
+    if not file_ids:
+        return
+    DEAD_LETTERS.append({
+        "id": f"{job['id']}:{dest['channel']}",
+        "setup": job["setup"],
+        "channel": dest["channel"],
+        "file_ids": file_ids,
+        "captions": dest["captions"][done:],
+        "error": str(error),
+        "transient": is_transient_error(error),
+        "failed_at": time.time(),
+        "replays": 0
+    })
+    del DEAD_LETTERS[:-DEAD_LETTER_MAX]
+    record_alert("dead_letter", dest["channel"], str(error))
+    save_state()
+
+async def replay_dead_letters(bot) -> dict:
+    """Post every dead letter again; posted ones leave the list, the rest keep their latest error."""
+    counts = {"posted": 0, "failed": 0, "paused": 0}
+    entries = [entry for entry in DEAD_LETTERS if not entry.get("replaying")]
+
+    async def replay(entry):
+        if breaker_open(entry["channel"]):
+            counts["paused"] += 1
+            return
+        entry["replaying"] = True
+        sent = []
+
+        async def send():
+            done = len(sent)
+            await send_album(bot, entry["channel"], entry["file_ids"][done:], entry["captions"][done:], sent)
+
+        try:
+            await deliver_post(entry["channel"], lambda: send_with_retry(send, f"replay {entry['id']}"))
+        except Exception as e:
+            entry["file_ids"] = entry["file_ids"][len(sent):]
+            entry["captions"] = entry["captions"][len(sent):]
+            entry.update(error=str(e), transient=is_transient_error(e), failed_at=time.time(), replays=entry["replays"] + 1)
+            counts["failed"] += 1
+            await record_destination_failure(bot, entry["channel"], e)
+        else:
+            DEAD_LETTERS.remove(entry)
+            counts["posted"] += 1
+            record_destination_success(entry["channel"])
+        finally:
+            entry.pop("replaying", None)
+
+    await asyncio.gather(*(replay(entry) for entry in entries))
+    save_state()
+    return counts
+
+def format_dead_letters(limit: int = 10) -> str:
+    if not DEAD_LETTERS:
+        return "No failed posts."
+    lines = []
+    for entry in DEAD_LETTERS[-limit:][::-1]:
+        when = datetime.fromtimestamp(entry["failed_at"], ZoneInfo("Asia/Kolkata")).strftime("%d %b %H:%M")
+        kind = "transient" if entry["transient"] else "permanent"
+        lines.append(
+            f"{when}  Setup {parse_setup_number(entry['setup'])} -> {entry['channel']}\n"
+            f"  {len(entry['file_ids'])} file(s), {kind}, replayed {entry['replays']}x\n"
+            f"  {entry['error'][:120]}"
+        )
+    if len(DEAD_LETTERS) > limit:
+        lines.append(f"... and {len(DEAD_LETTERS) - limit} older")
+    return "\n".join(lines)
+
+def dead_letters_panel(note: str = "") -> tuple:
+    """Text and keyboard of the failed posts panel."""
+    buttons = [[InlineKeyboardButton("🔁 Replay All", callback_data="replay_deadletters"),
+                InlineKeyboardButton("🗑 Clear", callback_data="clear_deadletters")]] if DEAD_LETTERS else []
+    return (
+        f"<b>📮 Failed posts ({len(DEAD_LETTERS)})</b>{note}\n<pre>{escape(format_dead_letters())}</pre>",
+        InlineKeyboardMarkup(buttons + [[InlineKeyboardButton("🔙 Back", callback_data="view_autosetup")]])
+    )
+
+async def replay_dead_letters_panel(bot, chat_id: int, message_id: int):
+    """Replay in the background, then show the result in the panel that started it."""
+    try:
+        counts = await replay_dead_letters(bot)
+        text, markup = dead_letters_panel(
+            f"\n<i>Replay: {counts['posted']} posted, {counts['failed']} failed, {counts['paused']} waiting on a paused destination.</i>"
+        )
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode="HTML", reply_markup=markup)
+    except Exception as e:
+        await notify_owner_on_error(bot, e, source="replay_dead_letters")
+
+# === CAPTION SYNC ===
+# A source caption edit that rotates the key is applied to the posts we already made from it
+# with one edit_message_caption each: no re-upload, no hold window
+POST_MAP = {}          # job id -> {"setup", "key", "use_entities", "sources", "posts"} (persisted in state.json)
+POST_SOURCES = {}      # "chat_id:message_id" of a source post -> job id in POST_MAP
+POST_MAP_MAX = 2000    # jobs remembered; the oldest are forgotten first
+
+def index_post_map(job_id: str):
+    for source in POST_MAP[job_id]["sources"]:
+        POST_SOURCES[source] = job_id
+
+async def remember_posts(bot, job: dict, destinations: list, key: str, use_entities: bool = True):
+    """Map a finished job's source posts to the destination messages it sent, as [channel, message_id, caption, key].
+
+    A caption edit that came in while the job was posting is applied right after.
+    """
+    if job.get("shadow"):
+        return
+    posts = [
+        [dest["channel"], msg.message_id, caption, key]
+        for dest in destinations
+        for msg, caption in zip(dest.get("sent") or [], dest.get("captions") or [])
+    ]
+    if not posts:
+        return
+    entry = POST_MAP.get(job["id"])
+    if entry:
+        entry["posts"] += posts  # a parked job that posted to its recovered destinations
+    else:
+        entry = POST_MAP[job["id"]] = {
+            "setup": job["setup"],
+            "key": key,
+            "use_entities": use_entities,
+            "sources": [f"{item['chat_id']}:{item['message_id']}" for item in job["items"]],
+            "posts": posts
+        }
+        index_post_map(job["id"])
+    while len(POST_MAP) > POST_MAP_MAX:
+        old_id = next(iter(POST_MAP))
+        for source in POST_MAP.pop(old_id)["sources"]:
+            if POST_SOURCES.get(source) == old_id:
+                del POST_SOURCES[source]
+    # POST_MAP reaches state.json with the next autosave, off the event loop
+
+    # New posts still show the job's key if the source was edited meanwhile
+    late_edit = job.pop("late_edit", None)
+    new_key = extract_key(*late_edit, use_entities=use_entities) if late_edit else entry["key"]
+    await rotate_posted_key(bot, entry, new_key)
+
+async def rotate_posted_key(bot, entry: dict, new_key) -> tuple:
+    """Edit every post of a POST_MAP entry that does not show new_key yet. Returns (edited, stale) posts."""
+    stale = [post for post in entry["posts"] if post[3] != new_key] if new_key else []
+    if not stale:
+        return 0, 0
+
+    async def edit(post):
+        channel, message_id, old_caption, old_key = post
+        new_caption = old_caption.replace(f"<code>{old_key}</code>", f"<code>{new_key}</code>")
+
+        async def send():
+            try:
+                await bot.edit_message_caption(chat_id=channel, message_id=message_id, caption=new_caption, parse_mode="HTML")
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+
+        try:
+            await deliver_post(channel, lambda: send_with_retry(send, f"edit {channel}:{message_id}"))
+        except Exception as e:
+            print(f"[EDIT] Caption of {channel}:{message_id} not updated: {e}")
+            return False
+        post[2], post[3] = new_caption, new_key
+        return True
+
+    # A post whose edit fails keeps its old key, so the same edit sent again retries just that post
+    results = await asyncio.gather(*(edit(post) for post in stale))
+    entry["key"] = new_key
+    print(f"[EDIT] Key {new_key} applied to {sum(results)}/{len(results)} posts")
+    return sum(results), len(results)
+
+def apply_caption_edit(message):
+    """Carry a source caption edit over to jobs still holding the post.
+
+    Returns (POST_MAP entry, new key) when posts already made from it need rotate_posted_key(), else None.
+    """
+    caption = message.caption or ""
+    entities = [e.to_dict() for e in message.caption_entities or []]
+
+    # A job that has not read its key yet simply posts the new caption. One that is posting
+    # already keeps the edit and applies it once its posts are mapped (remember_posts).
+    queued = False
+    for job in AUTO_JOBS.values():
+        if job["id"] in POST_MAP:
+            continue  # posted (a parked job may still post elsewhere later): edited below
+        for item in job["items"]:
+            if item["chat_id"] == message.chat_id and item["message_id"] == message.message_id:
+                item["caption"], item["caption_entities"] = caption, entities
+                if job["status"] == "posting":
+                    job["late_edit"] = [caption, entities]
+                queued = True
+    if queued:
+        save_auto_jobs()
+        return None
+
+    entry = POST_MAP.get(POST_SOURCES.get(f"{message.chat_id}:{message.message_id}"))
+    if not entry:
+        return None
+    return entry, extract_key(caption, entities, use_entities=entry["use_entities"])
+
+# === INTAKE BACKPRESSURE ===
+# Each setup runs at most max_concurrent jobs; past max_queued open jobs its overflow policy applies:
+# "queue" keeps taking posts without a countdown message each, "coalesce" gathers them into one
+# job per source (and, for single-mode setups, per key), "drop" counts and discards them.
+# AUTO_INTAKE_MAX always drops.
+OVERFLOW_POLICIES = ("queue", "coalesce", "drop")
+AUTO_INTAKE_MAX = 1000    # open jobs across all setups
+AUTO_RUNNING = set()      # job ids holding a setup slot
+SETUP_SLOTS = {}          # setup name -> (limit, Semaphore)
+OVERFLOW_DROPPED = {}     # setup name -> posts dropped by overflow (persisted in state.json)
+
+def setup_slots(setup_name: str) -> asyncio.Semaphore:
+    limit = max(1, int(AUTO_SETUP.get(setup_name, {}).get("max_concurrent", 3)))
+    slots = SETUP_SLOTS.get(setup_name)
+    if slots is None or slots[0] != limit:
+        # A changed limit gets a new semaphore; jobs holding the old one finish on it
+        slots = SETUP_SLOTS[setup_name] = (limit, asyncio.Semaphore(limit))
+    return slots[1]
+
+def admit_auto_post(setup_name: str) -> str:
+    """"accept", or the overflow policy to apply to one more post for this setup."""
+    if len(AUTO_JOBS) >= AUTO_INTAKE_MAX:
+        return "drop"
+    setup = AUTO_SETUP.get(setup_name, {})
+    depth = sum(1 for job in AUTO_JOBS.values() if job["setup"] == setup_name)
+    if depth < setup.get("max_queued", 20):
+        return "accept"
+    return setup.get("overflow", "queue")
+
+def drop_auto_post(setup_name: str, source):
+    OVERFLOW_DROPPED[setup_name] = OVERFLOW_DROPPED.get(setup_name, 0) + 1
+    record_alert("overflow", f"Auto {parse_setup_number(setup_name)}", f"dropped a post from {source}")
+    print(f"❌ {setup_name}: intake full, post dropped")
+
+def auto_queue_depth(setup_name: str) -> dict:
+    depth = {"holding": 0, "waiting": 0, "running": 0, "parked": 0}
+    for job in AUTO_JOBS.values():
+        if job["setup"] != setup_name:
+            continue
+        if job.get("parked"):
+            depth["parked"] += 1
+        elif job["id"] in AUTO_RUNNING:
+            depth["running"] += 1
+        elif job.get("started"):
+            depth["waiting"] += 1
+        else:
+            depth["holding"] += 1
+    return depth
+
+def parse_load_limits(text: str) -> dict:
+    """Owner input, one "name: value" per line: concurrent, queued, overflow."""
+    limits = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        name, _, value = line.partition(":")
+        name, value = name.strip().lower(), value.strip().lower()
+        if name in ("concurrent", "queued"):
+            if not value.isdigit() or int(value) < 1:
+                raise ValueError(f"{name} must be a whole number of at least 1")
+            limits[f"max_{name}"] = int(value)
+        elif name == "overflow":
+            if value not in OVERFLOW_POLICIES:
+                raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+            limits["overflow"] = value
+        else:
+            raise ValueError(f"unknown setting '{name}'")
+    return limits
+
+def format_queue_depth() -> list:
+    """The load report as blocks: the totals, then one per setup (see report_pages)."""
+    blocks = [
+        f"┌──── AUTO QUEUE ─────┐\n"
+        f"│ OPEN JOBS     >>  {len(AUTO_JOBS)}/{AUTO_INTAKE_MAX}\n"
+        f"│ PROBES        >>  {len(PROBE_PENDING)} pending"
+    ]
+    for name in setup_names():
+        setup = AUTO_SETUP[name]
+        depth = auto_queue_depth(name)
+        blocks.append(
+            f"├─ AUTO {parse_setup_number(name)}\n"
+            f"│ HOLD/WAIT/RUN >>  {depth['holding']}/{depth['waiting']}/{depth['running']} (parked {depth['parked']})\n"
+            f"│ LIMITS        >>  {setup.get('max_concurrent', 3)} at once, {setup.get('max_queued', 20)} open, {setup.get('overflow', 'queue')}\n"
+            f"│ DROPPED       >>  {OVERFLOW_DROPPED.get(name, 0)}"
+        )
+    blocks.append("└──────── END OF REPORT ────────┘")
+    return blocks
+
+# === FILE METADATA CACHE ===
+# Documents already carry size/name, so renderers read them from here instead of calling get_file
+FILE_META_CACHE = OrderedDict()   # file_id -> {"file_size", "file_name", "file_unique_id"}
+FILE_META_CACHE_SIZE = 1000
+
+def remember_file(file_id: str, file_size=None, file_name=None, file_unique_id=None) -> dict:
+    """Cache a file's metadata (LRU, bounded by FILE_META_CACHE_SIZE); known fields are kept."""
+    meta = FILE_META_CACHE.pop(file_id, {})
+    for field, value in (("file_size", file_size), ("file_name", file_name), ("file_unique_id", file_unique_id)):
+        if value is not None:
+            meta[field] = value
+    FILE_META_CACHE[file_id] = meta
+    while len(FILE_META_CACHE) > FILE_META_CACHE_SIZE:
+        FILE_META_CACHE.popitem(last=False)
+    return meta
+
+async def get_file_size(bot, file_id: str) -> int:
+    """Size in bytes from the cache; falls back to get_file() for files seen before a restart."""
+    meta = FILE_META_CACHE.get(file_id)
+    if meta and meta.get("file_size"):
+        FILE_META_CACHE.move_to_end(file_id)
+        return meta["file_size"]
+    file_info = await bot.get_file(file_id)
+    remember_file(file_id, file_info.file_size, file_unique_id=file_info.file_unique_id)
+    return file_info.file_size
+
 # Add this helper function at top
 def parse_buttons_grid_2x2(raw: str) -> InlineKeyboardMarkup:
     """
@@ -251,8 +1806,37 @@ def generate_method_keyboard(user_id: int) -> InlineKeyboardMarkup:
 
 # Load persisted state from previous session
 load_state()
+normalize_setups()
+refresh_setups()
 
 # === Keyboards ===
+REPORT_PAGE_CHARS = 3500  # one page of a settings report, leaving room for its title under Telegram's 4096
+
+def report_pages(blocks: list, sep: str = "\n\n") -> list:
+    """Pack (already escaped) report blocks into message-sized pages; a block is never split."""
+    pages = []
+    for block in blocks:
+        if pages and len(pages[-1]) + len(sep) + len(block) <= REPORT_PAGE_CHARS:
+            pages[-1] += sep + block
+        else:
+            pages.append(block[:REPORT_PAGE_CHARS])
+    return pages or [""]
+
+def report_page(data: str, pages: list) -> int:
+    """Page asked for by a "view_x:n" callback, clamped to the pages there are."""
+    page = data.partition(":")[2]
+    return min(int(page) if page.isdigit() else 0, len(pages) - 1)
+
+def page_buttons(base: str, page: int, pages: int) -> list:
+    """◀ n/m ▶ row for a paged report, none when it fits one page."""
+    if pages <= 1:
+        return []
+    return [[
+        InlineKeyboardButton("◀", callback_data=f"{base}:{(page - 1) % pages}"),
+        InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{base}:{page}"),
+        InlineKeyboardButton("▶", callback_data=f"{base}:{(page + 1) % pages}")
+    ]]
+
 owner_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton("UserStats")],
@@ -282,7 +1866,11 @@ async def autosave_task():
     while True:
         await asyncio.sleep(60)
         async with state_lock:
-            save_state()
+            try:
+                data = state_json()
+                await asyncio.to_thread(write_file_atomic, STATE_FILE, data)
+            except Exception as e:
+                print(f"[ERROR] Failed to save state.json: {e}")
 
 async def backup_config(context=None, query=None):
     now = datetime.now(ZoneInfo("Asia/Kolkata"))
@@ -1187,6 +2775,7 @@ async def process_method2_apk(update: Update, context: ContextTypes.DEFAULT_TYPE
         doc = update.message.document
         file_id = doc.file_id
         file_name = doc.file_name or ""
+        remember_file(file_id, doc.file_size, doc.file_name, doc.file_unique_id)
     
         state = USER_STATE.setdefault(user_id, {})
     
@@ -1211,6 +2800,8 @@ async def process_method2_apk(update: Update, context: ContextTypes.DEFAULT_TYPE
     
         session_files = state.setdefault("session_files", [])
         session_filenames = state.setdefault("session_filenames", [])
+        # file_id -> file_unique_id for the dedup check at send time; FILE_META_CACHE may have evicted it by then
+        session_unique_ids = state.setdefault("session_unique_ids", {})
     
         # Handle overflow (start a new session if more than 3)
         if len(session_files) >= 3:
@@ -1229,8 +2820,11 @@ async def process_method2_apk(update: Update, context: ContextTypes.DEFAULT_TYPE
             })
     
         # Append the new APK
+        if not session_files:
+            session_unique_ids.clear()
         session_files.append(file_id)
         session_filenames.append(file_name)
+        session_unique_ids[file_id] = doc.file_unique_id
     
         # Update tracking info
         state["last_apk_time"] = time.time()
@@ -1305,8 +2899,7 @@ async def start_method2_countdown(user_id: int, context: ContextTypes.DEFAULT_TY
         apk_lines = []
         for idx, (name, fid) in enumerate(zip(filenames, file_ids), start=1):
             try:
-                file_info = await context.bot.get_file(fid)
-                size = round(file_info.file_size / (1024 * 1024), 2)
+                size = round(await get_file_size(context.bot, fid) / (1024 * 1024), 2)
                 size_str = f"{size} MB" if size < 1024 else f"{round(size / 1024, 2)} GB"
             except:
                 size_str = "— MB"
@@ -1351,28 +2944,36 @@ async def start_method2_countdown(user_id: int, context: ContextTypes.DEFAULT_TY
             print(f"[Countdown Send Error] User: {user_id} | {e}")
             return
 
-        state["countdown_msg_id"] = sent.message_id
-
-        # Countdown loop
-        for sec in range(remaining_time - 1, -1, -1):
-            await asyncio.sleep(1)
-
-            if not state.get("countdown_msg_id"):
+        # A reset, cancel or newer countdown may have taken over the session while this one sent
+        async with get_lock(USER_LOCKS, user_id):
+            if USER_STATE.get(user_id) is not state or state.get("countdown_task") is not asyncio.current_task():
+                try:
+                    await context.bot.delete_message(chat_id, sent.message_id)
+                except:
+                    pass
                 return
+            state["countdown_msg_id"] = sent.message_id
+
+        # The progress ticker redraws the bar; this task only waits for the window to close
+        deadline = start_time + remaining_time
+        track_progress(
+            chat_id, sent.message_id,
+            lambda now: build_message(max(0, math.ceil(deadline - now))),
+            deadline,
+            reply_markup=keyboard,
+            text=build_message(remaining_time)
+        )
+        try:
+            while time.time() < deadline:
+                await asyncio.sleep(min(1, deadline - time.time()))
 
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=sent.message_id,
-                    text=build_message(sec),
-                    parse_mode="HTML",
-                    reply_markup=keyboard
-                )
-            except:
-                pass
+                if not state.get("countdown_msg_id"):
+                    return
 
-            if len(state["session_files"]) >= 3:
-                break
+                if len(state["session_files"]) >= 3:
+                    break
+        finally:
+            untrack_progress(chat_id, sent.message_id)
 
         # Delete countdown display
         try:
@@ -1380,23 +2981,28 @@ async def start_method2_countdown(user_id: int, context: ContextTypes.DEFAULT_TY
         except:
             pass
 
-        state["countdown_msg_id"] = None
-        state["countdown_task"] = None
-        state["waiting_key"] = True
+        # Ask for the key only if the session is still this countdown's: the check and the
+        # hand-over run under the user's lock, like the handlers that cancel or reset it
+        async with get_lock(USER_LOCKS, user_id):
+            if USER_STATE.get(user_id) is not state or state.get("countdown_msg_id") != sent.message_id:
+                return
+            state["countdown_msg_id"] = None
+            state["countdown_task"] = None
+            state["waiting_key"] = True
 
-        # Key input prompt message
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=(
-                "<b>▌ METHOD 2 SYSTEM ▌</b>\n"
-                "<blockquote>"
-                "▶ Send your Key now\n"
-                "▶ Applies to all Mods / Loaders\n"
-                "────────────────────"
-                "</blockquote>"
-            ),
-            parse_mode="HTML"
-        )
+            # Key input prompt message
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=(
+                    "<b>▌ METHOD 2 SYSTEM ▌</b>\n"
+                    "<blockquote>"
+                    "▶ Send your Key now\n"
+                    "▶ Applies to all Mods / Loaders\n"
+                    "────────────────────"
+                    "</blockquote>"
+                ),
+                parse_mode="HTML"
+            )
 
     except Exception as e:
         await notify_owner_on_error(context.bot, e, source="start_method2_countdown")
@@ -1410,6 +3016,7 @@ async def method2_send_to_channel(user_id, context):
     
         session_files = state.get("session_files", [])
         session_filenames = state.get("session_filenames", [])
+        session_unique_ids = state.get("session_unique_ids", {})
         key = state.get("saved_key", "")
         key_mode = state.get("key_mode", "normal")
     
@@ -1421,13 +3028,47 @@ async def method2_send_to_channel(user_id, context):
             )
             return
     
+        # Files this channel already got with the same key recently are not posted again
+        fresh = [
+            dedup_claim(channel_id, session_unique_ids.get(file_id), key)
+            for file_id in session_files
+        ]
+        if not all(fresh):
+            count_duplicates("method2", fresh.count(False))
+            session_files = [file_id for file_id, ok in zip(session_files, fresh) if ok]
+            session_filenames = [name for name, ok in zip(session_filenames, fresh) if ok]
+            if not session_files:
+                await context.bot.send_message(
+                    chat_id=user_id,
+                    text=f"⚠️ <b>Already posted!</b>\nThese APKs went to your channel with this key in the last {DEDUP_TTL // 60} min, so nothing was sent.",
+                    parse_mode="HTML"
+                )
+                # Nothing left to send: start clean instead of waiting for a key again
+                state.update({
+                    "session_files": [],
+                    "session_filenames": [],
+                    "session_unique_ids": {},
+                    "saved_key": None,
+                    "waiting_key": False,
+                    "key_prompt_sent": False,
+                    "quote_applied": False,
+                    "mono_applied": False,
+                    "last_apk_time": None,
+                    "key_mode": "normal",
+                    "countdown_msg_id": None,
+                    "countdown_task": None
+                })
+                return
+
         # Auto-reset previous post data to avoid old delete targets
         state["apk_posts"] = []
         state["last_post_session"] = {}
 
         posted_ids = []
+        posted_captions = []
         last_message = None
 
+        captions = []
         for idx, file_id in enumerate(session_files, start=1):
             is_last_apk = (idx == len(session_files))
 
@@ -1450,14 +3091,33 @@ async def method2_send_to_channel(user_id, context):
                     if is_last_apk or len(session_files) == 1
                     else f"Key - {key}"
                 )
+            captions.append(caption)
 
-            sent_message = await context.bot.send_document(
-                chat_id=channel_id,
-                document=file_id,
-                caption=caption,
-                parse_mode="HTML"
-            )
+        sent_messages = []
+
+        async def send():
+            if ALBUM_POSTING:
+                sent_messages.extend(await send_album(context.bot, channel_id, session_files, captions))
+            else:
+                for file_id, caption in zip(session_files, captions):
+                    sent_messages.append(await context.bot.send_document(
+                        chat_id=channel_id,
+                        document=file_id,
+                        caption=caption,
+                        parse_mode="HTML"
+                    ))
+
+        try:
+            await deliver_post(channel_id, send)
+        except Exception:
+            if not sent_messages:
+                for file_id in session_files:
+                    dedup_release(channel_id, session_unique_ids.get(file_id), key)
+            raise
+
+        for sent_message, caption in zip(sent_messages, captions):
             posted_ids.append(sent_message.message_id)
+            posted_captions.append(caption)
             last_message = sent_message
 
         if not posted_ids:
@@ -1489,7 +3149,8 @@ async def method2_send_to_channel(user_id, context):
             "key_mode": key_mode,
             "caption_template": saved_caption,
             "channel_id": channel_id,
-            "post_message_ids": posted_ids
+            "post_message_ids": posted_ids,
+            "captions": posted_captions
         }
         
        # Store message IDs for deletion panel
@@ -1499,6 +3160,7 @@ async def method2_send_to_channel(user_id, context):
         state.update({
             "session_files": [],
             "session_filenames": [],
+            "session_unique_ids": {},
             "saved_key": None,
             "waiting_key": False,
             "key_prompt_sent": False,
@@ -1596,8 +3258,7 @@ async def method2_convert_quote(user_id, context: ContextTypes.DEFAULT_TYPE):
     
         for idx, (file_id, file_name) in enumerate(zip(session_files, session_filenames), start=1):
             try:
-                file_info = await context.bot.get_file(file_id)
-                file_size = round(file_info.file_size / (1024 * 1024), 2)
+                file_size = round(await get_file_size(context.bot, file_id) / (1024 * 1024), 2)
             except Exception as e:
                 print(f"Failed to fetch file size: {e}")
                 file_size = "?"
@@ -1665,8 +3326,7 @@ async def method2_convert_mono(user_id, context: ContextTypes.DEFAULT_TYPE):
     
         for idx, (file_id, file_name) in enumerate(zip(session_files, session_filenames), start=1):
             try:
-                file_info = await context.bot.get_file(file_id)
-                file_size = round(file_info.file_size / (1024 * 1024), 2)
+                file_size = round(await get_file_size(context.bot, file_id) / (1024 * 1024), 2)
             except Exception as e:
                 print(f"Failed to fetch file size: {e}")
                 file_size = "?"
@@ -1802,8 +3462,7 @@ async def method2_show_preview(user_id, context):
     
         for idx, (file_id, file_name) in enumerate(zip(session_files, session_filenames), start=1):
             try:
-                file_info = await context.bot.get_file(file_id)
-                file_size = round(file_info.file_size / (1024 * 1024), 2)
+                file_size = round(await get_file_size(context.bot, file_id) / (1024 * 1024), 2)
             except Exception as e:
                 print(f"Failed to fetch file size: {e}")
                 file_size = "?"
@@ -1934,18 +3593,82 @@ async def method2_back_fullmenu(user_id, context):
     except Exception as e:
         await notify_owner_on_error(context.bot, e, source="method2_back_fullmenu")
 
-async def auto_recaption(user_id, context):
-    try:
-        state = USER_STATE.get(user_id, {})
-        session = state.get("last_post_session", {})
-    
-        file_ids = session.get("file_ids")
-        filenames = session.get("filenames", [])
-        key = session.get("key")
-        key_mode = session.get("key_mode", "normal")
+async def send_album(bot, chat_id, file_ids: list, captions: list, sent: list = None, **kwargs) -> list:
+    """Post files as media groups of up to ALBUM_MAX_ITEMS; a lone file goes as a plain document.
+
+    Extra kwargs (e.g. disable_notification) go to every send. Returns the sent messages in file order;
+    a given `sent` list is filled as they go out, so the caller still sees them if a later part fails.
+    """
+    sent = [] if sent is None else sent
+    for start in range(0, len(file_ids), ALBUM_MAX_ITEMS):
+        chunk = list(zip(file_ids[start:start + ALBUM_MAX_ITEMS], captions[start:start + ALBUM_MAX_ITEMS]))
+        if len(chunk) == 1:
+            file_id, caption = chunk[0]
+            sent.append(await bot.send_document(chat_id=chat_id, document=file_id, caption=caption, parse_mode="HTML", **kwargs))
+            continue
+        media = [
+            InputMediaDocument(media=file_id, caption=caption, parse_mode="HTML") if caption else InputMediaDocument(media=file_id)
+            for file_id, caption in chunk
+        ]
+        sent.extend(await bot.send_media_group(chat_id=chat_id, media=media, **kwargs))
+    return sent
+
+async def recaption_posts(bot, session: dict, captions: list) -> list:
+    """Give the posted files of a Method 2 session new captions (None = no caption).
+
+    Only captions that change are edited, in place. The files are reposted as a media
+    group and the old posts deleted only when editing is impossible (or disabled).
+    Returns the message ids that now hold the files.
+    """
+    channel_id = session["channel_id"]
+    file_ids = session["file_ids"]
+    old_posts = session.get("post_message_ids", [])
+    old_captions = session.get("captions") or [False] * len(old_posts)  # False = unknown, always edit
+
+    if RECAPTION_IN_PLACE and old_posts and len(old_posts) == len(file_ids):
+        try:
+            for msg_id, old_caption, caption in zip(old_posts, old_captions, captions):
+                if old_caption == caption:
+                    continue
+                try:
+                    await bot.edit_message_caption(
+                        chat_id=channel_id,
+                        message_id=msg_id,
+                        caption=caption,
+                        parse_mode="HTML"
+                    )
+                except BadRequest as e:
+                    if "not modified" not in str(e).lower():
+                        raise
+            session["captions"] = list(captions)
+            return list(old_posts)
+        except BadRequest as e:
+            print(f"[RECAPTION] In-place edit failed in {channel_id}, reposting: {e}")
+
+    new_posts = await send_album(bot, channel_id, file_ids, captions)
+
+    for msg_id in old_posts:
+        try:
+            await bot.delete_message(chat_id=channel_id, message_id=msg_id)
+        except:
+            pass
+
+    new_ids = [msg.message_id for msg in new_posts]
+    session["post_message_ids"] = new_ids
+    session["captions"] = list(captions)
+    return new_ids
+
+async def auto_recaption(user_id, context):
+    try:
+        state = USER_STATE.get(user_id, {})
+        session = state.get("last_post_session", {})
+    
+        file_ids = session.get("file_ids")
+        filenames = session.get("filenames", [])
+        key = session.get("key")
+        key_mode = session.get("key_mode", "normal")
         caption_template = session.get("caption_template", "")
         channel_id = session.get("channel_id")
-        old_posts = session.get("post_message_ids", [])
         preview_message_id = state.get("preview_message_id")
     
         if not file_ids or not key or not caption_template or not channel_id:
@@ -1956,8 +3679,8 @@ async def auto_recaption(user_id, context):
             )
             return
     
-        # Build media group with updated captions
-        media = []
+        # Build updated captions
+        captions = []
         for idx, file_id in enumerate(file_ids, start=1):
             is_last_apk = (idx == len(file_ids))
     
@@ -1980,25 +3703,15 @@ async def auto_recaption(user_id, context):
                     else f"Key - {key}"
                 )
     
-            media.append(InputMediaDocument(media=file_id, caption=caption, parse_mode="HTML"))
-    
-        # Send new media group
-        new_posts = await context.bot.send_media_group(chat_id=channel_id, media=media)
-    
-        # Delete old channel messages
-        for msg_id in old_posts:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            except:
-                pass
+            captions.append(caption)
     
-        # Save new message IDs
-        new_ids = [msg.message_id for msg in new_posts]
-        last_msg = new_posts[-1]
+        # Edit captions in place (reposts only if that fails)
+        new_ids = await recaption_posts(context.bot, session, captions)
+        last_msg_id = new_ids[-1]
         post_link = (
-            f"https://t.me/{channel_id.strip('@')}/{last_msg.message_id}"
+            f"https://t.me/{channel_id.strip('@')}/{last_msg_id}"
             if channel_id.startswith("@") else
-            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg.message_id}"
+            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg_id}"
             if channel_id.startswith("-100") else
             "Unknown"
         )
@@ -2006,7 +3719,6 @@ async def auto_recaption(user_id, context):
         # Update state with new post info
         state["apk_posts"] = new_ids
         state["last_post_link"] = post_link
-        state["last_post_session"]["post_message_ids"] = new_ids
     
         # Rebuild buttons
         buttons = [
@@ -2053,22 +3765,14 @@ async def auto_last_caption(user_id, context):
         key_mode = session.get("key_mode", "normal")
         caption_template = session.get("caption_template", "")
         channel_id = session.get("channel_id")
-        old_posts = session.get("post_message_ids", [])
         preview_message_id = state.get("preview_message_id")
     
         if not file_ids or not key or not caption_template or not channel_id:
             await context.bot.send_message(chat_id=user_id, text="⚠️ No session data found.")
             return
     
-        # Delete old channel posts
-        for msg_id in old_posts:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            except:
-                pass
-    
-        # Build new media group with key only on last file
-        media = []
+        # Build captions with key only on last file
+        captions = []
         for idx, file_id in enumerate(file_ids, start=1):
             if idx == len(file_ids):  # last file only
                 if key_mode == "quote":
@@ -2077,26 +3781,22 @@ async def auto_last_caption(user_id, context):
                     caption = caption_template.replace("Key -", f"Key - <code>{key}</code>")
                 else:
                     caption = caption_template.replace("Key -", f"Key - {key}")
-                media.append(InputMediaDocument(media=file_id, caption=caption, parse_mode="HTML"))
+                captions.append(caption)
             else:
-                media.append(InputMediaDocument(media=file_id))  # No caption
-    
-        # Send new media group
-        new_posts = await context.bot.send_media_group(chat_id=channel_id, media=media)
+                captions.append(None)  # No caption
     
-        # Track new message IDs
-        new_ids = [msg.message_id for msg in new_posts]
-        last_msg = new_posts[-1]
+        # Edit captions in place (reposts only if that fails)
+        new_ids = await recaption_posts(context.bot, session, captions)
+        last_msg_id = new_ids[-1]
         post_link = (
-            f"https://t.me/{channel_id.strip('@')}/{last_msg.message_id}"
+            f"https://t.me/{channel_id.strip('@')}/{last_msg_id}"
             if channel_id.startswith("@") else
-            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg.message_id}"
+            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg_id}"
         )
     
         # Update state
         state["apk_posts"] = new_ids
         state["last_post_link"] = post_link
-        state["last_post_session"]["post_message_ids"] = new_ids
     
         # Rebuild buttons
         buttons = [
@@ -2140,22 +3840,14 @@ async def last_caption_key(user_id, context):
         channel_id = session.get("channel_id")
         key = session.get("key")
         key_mode = session.get("key_mode", "normal")
-        old_posts = session.get("post_message_ids", [])
         preview_message_id = state.get("preview_message_id")
     
         if not file_ids or not key or not channel_id:
             await context.bot.send_message(chat_id=user_id, text="⚠️ No session data found.")
             return
     
-        # Delete old posts
-        for msg_id in old_posts:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            except:
-                pass
-    
-        # Prepare media group with only key caption on last APK
-        media = []
+        # Only key caption on last APK
+        captions = []
         for idx, file_id in enumerate(file_ids, start=1):
             if idx == len(file_ids):
                 if key_mode == "quote":
@@ -2164,24 +3856,22 @@ async def last_caption_key(user_id, context):
                     caption = f"Key - <code>{key}</code>"
                 else:
                     caption = f"Key - {key}"
-                media.append(InputMediaDocument(media=file_id, caption=caption, parse_mode="HTML"))
+                captions.append(caption)
             else:
-                media.append(InputMediaDocument(media=file_id))
+                captions.append(None)
     
-        new_posts = await context.bot.send_media_group(chat_id=channel_id, media=media)
+        new_ids = await recaption_posts(context.bot, session, captions)
     
         # Update state with new post data
-        new_ids = [msg.message_id for msg in new_posts]
-        last_msg = new_posts[-1]
+        last_msg_id = new_ids[-1]
         post_link = (
-            f"https://t.me/{channel_id.strip('@')}/{last_msg.message_id}"
+            f"https://t.me/{channel_id.strip('@')}/{last_msg_id}"
             if channel_id.startswith("@") else
-            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg.message_id}"
+            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg_id}"
         )
     
         state["apk_posts"] = new_ids
         state["last_post_link"] = post_link
-        state["last_post_session"]["post_message_ids"] = new_ids
     
         # Rebuild buttons
         buttons = [
@@ -2225,22 +3915,14 @@ async def key_after_apks(user_id, context):
         channel_id = session.get("channel_id")
         key = session.get("key")
         key_mode = session.get("key_mode", "normal")
-        old_posts = session.get("post_message_ids", [])
         preview_message_id = state.get("preview_message_id")
 
         if not file_ids or not key or not channel_id:
             await context.bot.send_message(chat_id=user_id, text="⚠️ No session data found.")
             return
 
-        # Delete previously posted messages
-        for msg_id in old_posts:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            except:
-                pass
-
-        # Prepare new media group
-        media = []
+        # Prepare new captions
+        captions = []
         for idx, file_id in enumerate(file_ids):
             if idx == len(file_ids) - 1:
                 # LAST APK gets the key caption
@@ -2251,25 +3933,23 @@ async def key_after_apks(user_id, context):
                 else:
                     caption = f"{key}"
 
-                media.append(InputMediaDocument(media=file_id, caption=caption, parse_mode="HTML"))
+                captions.append(caption)
             else:
-                media.append(InputMediaDocument(media=file_id))
+                captions.append(None)
 
-        new_posts = await context.bot.send_media_group(chat_id=channel_id, media=media)
+        post_ids = await recaption_posts(context.bot, session, captions)
 
         # Update post info
-        post_ids = [m.message_id for m in new_posts]
-        last_msg = new_posts[-1]
+        last_msg_id = post_ids[-1]
         post_link = (
-            f"https://t.me/{channel_id.strip('@')}/{last_msg.message_id}"
+            f"https://t.me/{channel_id.strip('@')}/{last_msg_id}"
             if str(channel_id).startswith("@")
-            else f"https://t.me/c/{str(channel_id).replace('-100', '')}/{last_msg.message_id}"
+            else f"https://t.me/c/{str(channel_id).replace('-100', '')}/{last_msg_id}"
         )
 
         # Save state
         state["apk_posts"] = post_ids
         state["last_post_link"] = post_link
-        session["post_message_ids"] = post_ids
 
         # Inline buttons
         buttons = [
@@ -2313,25 +3993,17 @@ async def caption_plus_key(user_id, context):
         key = session.get("key")
         key_mode = session.get("key_mode", "normal")
         saved_caption = session.get("caption_template", "")
-        old_posts = session.get("post_message_ids", [])
         preview_message_id = state.get("preview_message_id")
 
         if not file_ids or not key or not channel_id:
             await context.bot.send_message(chat_id=user_id, text="⚠️ No session data found.")
             return
 
-        # Step 1: Delete old posts
-        for msg_id in old_posts:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=msg_id)
-            except:
-                pass
-
-        # Step 2: Clean caption (remove "Key -")
+        # Step 1: Clean caption (remove "Key -")
         cleaned_caption = saved_caption.replace("Key -", "").strip()
 
-        # Step 3: Build media group
-        media = []
+        # Step 2: Build captions
+        captions = []
         for idx, file_id in enumerate(file_ids):
             if idx == len(file_ids) - 1:
                 # Format key as per mode
@@ -2343,24 +4015,23 @@ async def caption_plus_key(user_id, context):
                     tail = f"{key}"
 
                 final_caption = f"{tail}\n{cleaned_caption}"
-                media.append(InputMediaDocument(media=file_id, caption=final_caption, parse_mode="HTML"))
+                captions.append(final_caption)
             else:
-                media.append(InputMediaDocument(media=file_id))
+                captions.append(None)
 
-        new_posts = await context.bot.send_media_group(chat_id=channel_id, media=media)
+        # Step 3: Edit captions in place (reposts only if that fails)
+        new_ids = await recaption_posts(context.bot, session, captions)
 
         # Step 4: Update state
-        new_ids = [msg.message_id for msg in new_posts]
-        last_msg = new_posts[-1]
+        last_msg_id = new_ids[-1]
         post_link = (
-            f"https://t.me/{channel_id.strip('@')}/{last_msg.message_id}"
+            f"https://t.me/{channel_id.strip('@')}/{last_msg_id}"
             if channel_id.startswith("@") else
-            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg.message_id}"
+            f"https://t.me/c/{channel_id.replace('-100', '')}/{last_msg_id}"
         )
 
         state["apk_posts"] = new_ids
         state["last_post_link"] = post_link
-        session["post_message_ids"] = new_ids
 
         # Step 5: Buttons
         buttons = [
@@ -2646,18 +4317,81 @@ async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT
             await query.edit_message_text(
                 "<b>🔧 Select a setup to view details:</b>",
                 parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Auto Setup 1", callback_data="viewsetup1")],
-                    [InlineKeyboardButton("Auto Setup 2", callback_data="viewsetup2")],
-                    [InlineKeyboardButton("Auto Setup 3", callback_data="viewsetup3")],
-                    [InlineKeyboardButton("Auto Setup 4", callback_data="viewsetup4")],
-                    [InlineKeyboardButton("🔙 Back", callback_data="settings_back")]
-                ])
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton(f"Auto Setup {parse_setup_number(name)}", callback_data=f"view{name}")] for name in setup_names()] +
+                    [[InlineKeyboardButton("⏱ Pipeline Latency", callback_data="view_latency"),
+                      InlineKeyboardButton("🧪 Shadow Report", callback_data="view_shadow")]] +
+                    [[InlineKeyboardButton("🚦 Queue Depth", callback_data="view_queue"),
+                      InlineKeyboardButton("📮 Failed Posts", callback_data="view_deadletters")]] +
+                    [[InlineKeyboardButton("🔙 Back", callback_data="settings_back")]]
+                )
+            )
+            return
+    
+        elif data.partition(":")[0] == "view_queue":
+            pages = report_pages([escape(block) for block in format_queue_depth()], sep="\n")
+            page = report_page(data, pages)
+            await query.edit_message_text(
+                f"<b>🚦 Auto pipeline load</b>\n<pre>{pages[page]}</pre>",
+                parse_mode="HTML",
+                reply_markup=InlineKeyboardMarkup(
+                    page_buttons("view_queue", page, len(pages)) + [
+                        [InlineKeyboardButton("🔄 Refresh", callback_data=f"view_queue:{page}")],
+                        [InlineKeyboardButton("🔙 Back", callback_data="view_autosetup")]
+                    ]
+                )
+            )
+            return
+    
+        elif data in ("view_deadletters", "replay_deadletters", "clear_deadletters"):
+            note = ""
+            if data == "replay_deadletters":
+                await query.edit_message_text(
+                    f"<b>🔁 Replaying {len(DEAD_LETTERS)} failed post(s)...</b>\n<i>This panel updates when it is done.</i>",
+                    parse_mode="HTML"
+                )
+                # Replays can take minutes behind the destination queues; the owner's chat stays usable meanwhile
+                context.application.create_task(
+                    replay_dead_letters_panel(context.bot, query.message.chat_id, query.message.message_id)
+                )
+                return
+            elif data == "clear_deadletters":
+                note = f"\n<i>Cleared {len(DEAD_LETTERS)} failed post(s).</i>"
+                DEAD_LETTERS.clear()
+                save_state()
+            text, markup = dead_letters_panel(note)
+            await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+            return
+    
+        elif data.partition(":")[0] == "view_shadow":
+            names = [name for name in setup_names() if AUTO_SETUP[name].get("shadow") or name in SHADOW_STATS]
+            pages = report_pages([escape(format_shadow_report(name)) for name in names] or ["No setup has run in shadow mode."])
+            page = report_page(data, pages)
+            await query.edit_message_text(
+                f"<b>🧪 Shadow runs (recorded, not posted)</b>\n<pre>{pages[page]}</pre>",
+                parse_mode="HTML",
+                reply_markup=InlineKeyboardMarkup(
+                    page_buttons("view_shadow", page, len(pages)) +
+                    [[InlineKeyboardButton("🔙 Back", callback_data="view_autosetup")]]
+                )
+            )
+            return
+    
+        elif data.partition(":")[0] == "view_latency":
+            pages = report_pages([escape(format_latency_report(name)) for name in setup_names()])
+            page = report_page(data, pages)
+            await query.edit_message_text(
+                f"<b>⏱ Source post → destination post, per stage</b>\n<pre>{pages[page]}</pre>",
+                parse_mode="HTML",
+                reply_markup=InlineKeyboardMarkup(
+                    page_buttons("view_latency", page, len(pages)) +
+                    [[InlineKeyboardButton("🔙 Back", callback_data="view_autosetup")]]
+                )
             )
             return
     
         elif data.startswith("viewsetup"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             s = AUTO_SETUP.get(f"setup{setup_num}", {})
     
             total_keys = s.get("completed_count", 0)
@@ -2667,17 +4401,25 @@ async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT
             caption_ok = "✅" if s.get("dest_caption") else "❌"
             key_mode = s.get("key_mode", "auto").capitalize()
             style = s.get("style", "mono").capitalize()
+            mode = s.get("mode", "single").capitalize()
             status = "✅ ON" if s.get("enabled") else "⛔ OFF"
     
             msg = (
                 f"<pre>"
                 f"┌──── AUTO {setup_num} SYSTEM DIAG ─────┐\n"
+                f"│ MODE          >>  {mode}{' (shadow)' if s.get('shadow') else ''}\n"
                 f"│ SOURCE        >>  {source}\n"
                 f"│ DESTINATION   >>  {dest}\n"
+                f"│ EXTRA_DESTS   >>  {len(s.get('extra_destinations') or [])}\n"
                 f"│ CAPTION       >>  {caption_ok}\n"
                 f"│ KEY_MODE      >>  {key_mode}\n"
                 f"│ STYLE         >>  {style}\n"
                 f"│ STATUS        >>  {status}\n"
+                f"│ FILTERS       >>  {len(SETUP_FILTERS.get(f'setup{setup_num}', []))} rules\n"
+                f"│ REJECTED      >>  {sum(FILTER_REJECTIONS.get(f'setup{setup_num}', {}).values())}\n"
+                f"│ DUPLICATES    >>  {DEDUP_SKIPPED.get(f'setup{setup_num}', 0)}\n"
+                f"│ LOAD          >>  {s.get('max_concurrent', 3)}/{s.get('max_queued', 20)} {s.get('overflow', 'queue')}, dropped {OVERFLOW_DROPPED.get(f'setup{setup_num}', 0)}\n"
+                f"│ HOLD          >>  {auto_hold_seconds(f'setup{setup_num}'):g}s ({s.get('hold_min', 2):g}-{s.get('hold_max', AUTO_HOLD_SECONDS):g}s)\n"
                 f"│ KEYS_SENT     >>  {total_keys}\n"
                 f"│ TOTAL_APKS    >>  {total_apks} APK{'s' if total_apks != 1 else ''}\n"
                 f"└──────── END OF REPORT ────────┘"
@@ -2792,29 +4534,26 @@ async def handle_settings_callback(update: Update, context: ContextTypes.DEFAULT
             chat_id = message.chat_id
         
             async def cancel_zip_restore():
-                for elapsed in range(1, 21):
-                    await asyncio.sleep(1)
-                    state = USER_STATE.get(user_id, {})
-                    if not state.get("awaiting_zip"):
-                        return
-        
-                    arrows = ">" * elapsed
-                    dashes = "-" * (20 - elapsed)
+                started = time.time()
+        
+                def render(now):
+                    elapsed = min(20, int(now - started))
+                    bar = ">" * elapsed + "-" * (20 - elapsed)
                     percent = int((elapsed / 20) * 100)
-                    bar = arrows + dashes
+                    return (
+                        "📁 <b>Please upload your backup ZIP file now.</b>\n"
+                        f"⏳ <b>[{bar}] ({percent}%)</b>"
+                    )
         
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message.message_id,
-                            text=(
-                                "📁 <b>Please upload your backup ZIP file now.</b>\n"
-                                f"⏳ <b>[{bar}] ({percent}%)</b>"
-                            ),
-                            parse_mode="HTML"
-                        )
-                    except:
-                        pass
+                track_progress(chat_id, message.message_id, render, started + 20)
+                try:
+                    for _ in range(20):
+                        await asyncio.sleep(1)
+                        state = USER_STATE.get(user_id, {})
+                        if not state.get("awaiting_zip"):
+                            return
+                finally:
+                    untrack_progress(chat_id, message.message_id)
         
                 # Timeout
                 state = USER_STATE.get(user_id, {})
@@ -3422,7 +5161,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ========= Method 3 (Auto 1, 2, 3) ========= #
             
         elif state.get("status", "").startswith("waiting_source"):
-            setup_num = state["status"][-1]
+            setup_num = parse_setup_number(state["status"])
             text = update.message.text.strip()
         
             if not (text.startswith("@") or text.startswith("-100")):
@@ -3468,7 +5207,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ------------------------------
         
         elif state.get("status", "").startswith("waiting_dest"):
-            setup_num = state["status"][-1]
+            setup_num = parse_setup_number(state["status"])
             text = update.message.text.strip()
         
             if not (text.startswith("@") or text.startswith("-100")):
@@ -3514,7 +5253,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # ------------------------------
         
         elif state.get("status", "").startswith("waiting_caption"):
-            setup_num = state["status"][-1]
+            setup_num = parse_setup_number(state["status"])
             text = update.message.text.strip()
         
             if "Key -" not in text:
@@ -3547,6 +5286,141 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
+        elif state.get("status", "").startswith("waiting_extradest"):
+            setup_num = parse_setup_number(state["status"])
+            text = update.message.text.strip()
+        
+            try:
+                destinations = parse_destinations(text)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ Invalid destinations: {e}")
+                return
+        
+            AUTO_SETUP[f"setup{setup_num}"]["extra_destinations"] = destinations
+            USER_STATE[user_id]["status"] = "normal"
+            save_config()
+        
+            keyboard = [
+                [InlineKeyboardButton("📡 Set Source", callback_data=f"setsource{setup_num}"),
+                 InlineKeyboardButton("🎯 Set Destination", callback_data=f"setdest{setup_num}")],
+                [InlineKeyboardButton("🛰 Extra Destinations", callback_data=f"setextradest{setup_num}")],
+                [InlineKeyboardButton("✅ On", callback_data=f"on{setup_num}"),
+                 InlineKeyboardButton("⛔ Off", callback_data=f"off{setup_num}")],
+                [InlineKeyboardButton("👁️ View Setup", callback_data=f"viewsetup{setup_num}"),
+                 InlineKeyboardButton("🧹 Reset Setup", callback_data=f"resetsetup{setup_num}")],
+                [InlineKeyboardButton("🔙 Back to Auto Menu", callback_data="method_3")]
+            ]
+        
+            await update.message.reply_text(
+                f"✅ {len(destinations)} extra destination{'s' if len(destinations) != 1 else ''} saved for Auto {setup_num}!\n\nChoose your next action:",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="HTML"
+            )
+            return
+        
+        elif state.get("status", "").startswith("waiting_limits"):
+            setup_num = parse_setup_number(state["status"])
+            text = update.message.text.strip()
+        
+            try:
+                limits = parse_load_limits(text)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ Invalid load limits: {e}")
+                return
+        
+            AUTO_SETUP[f"setup{setup_num}"].update(limits)
+            USER_STATE[user_id]["status"] = "normal"
+            save_config()
+        
+            keyboard = [
+                [InlineKeyboardButton("📡 Set Source", callback_data=f"setsource{setup_num}"),
+                 InlineKeyboardButton("🎯 Set Destination", callback_data=f"setdest{setup_num}")],
+                [InlineKeyboardButton("⏱ Hold Window", callback_data=f"sethold{setup_num}"),
+                 InlineKeyboardButton("🚦 Load Limits", callback_data=f"setlimits{setup_num}")],
+                [InlineKeyboardButton("✅ On", callback_data=f"on{setup_num}"),
+                 InlineKeyboardButton("⛔ Off", callback_data=f"off{setup_num}")],
+                [InlineKeyboardButton("👁️ View Setup", callback_data=f"viewsetup{setup_num}"),
+                 InlineKeyboardButton("🧹 Reset Setup", callback_data=f"resetsetup{setup_num}")],
+                [InlineKeyboardButton("🔙 Back to Auto Menu", callback_data="method_3")]
+            ]
+        
+            setup = AUTO_SETUP[f"setup{setup_num}"]
+            await update.message.reply_text(
+                f"✅ Load limits saved for Auto {setup_num}: {setup['max_concurrent']} at once, "
+                f"{setup['max_queued']} open, overflow {setup['overflow']}.\n\nChoose your next action:",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="HTML"
+            )
+            return
+        
+        elif state.get("status", "").startswith("waiting_hold"):
+            setup_num = parse_setup_number(state["status"])
+            text = update.message.text.strip()
+        
+            try:
+                hold_min, hold_max = parse_hold_bounds(text)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ Invalid hold window: {e}")
+                return
+        
+            AUTO_SETUP[f"setup{setup_num}"]["hold_min"] = hold_min
+            AUTO_SETUP[f"setup{setup_num}"]["hold_max"] = hold_max
+            USER_STATE[user_id]["status"] = "normal"
+            save_config()
+        
+            keyboard = [
+                [InlineKeyboardButton("📡 Set Source", callback_data=f"setsource{setup_num}"),
+                 InlineKeyboardButton("🎯 Set Destination", callback_data=f"setdest{setup_num}")],
+                [InlineKeyboardButton("🛰 Extra Destinations", callback_data=f"setextradest{setup_num}"),
+                 InlineKeyboardButton("⏱ Hold Window", callback_data=f"sethold{setup_num}")],
+                [InlineKeyboardButton("✅ On", callback_data=f"on{setup_num}"),
+                 InlineKeyboardButton("⛔ Off", callback_data=f"off{setup_num}")],
+                [InlineKeyboardButton("👁️ View Setup", callback_data=f"viewsetup{setup_num}"),
+                 InlineKeyboardButton("🧹 Reset Setup", callback_data=f"resetsetup{setup_num}")],
+                [InlineKeyboardButton("🔙 Back to Auto Menu", callback_data="method_3")]
+            ]
+        
+            await update.message.reply_text(
+                f"✅ Hold window {hold_min:g}-{hold_max:g}s saved for Auto {setup_num}!\n\nChoose your next action:",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="HTML"
+            )
+            return
+        
+        elif state.get("status", "").startswith("waiting_filters"):
+            setup_num = parse_setup_number(state["status"])
+            text = update.message.text.strip()
+        
+            try:
+                filter_rules = parse_filter_rules(text)
+                build_filter_chain(filter_rules)
+            except (ValueError, re.error) as e:
+                await update.message.reply_text(f"❌ Invalid filter rules: {e}")
+                return
+        
+            AUTO_SETUP[f"setup{setup_num}"]["filters"] = filter_rules
+            USER_STATE[user_id]["status"] = "normal"
+            save_config()
+        
+            keyboard = [
+                [InlineKeyboardButton("📡 Set Source", callback_data=f"setsource{setup_num}"),
+                 InlineKeyboardButton("🎯 Set Destination", callback_data=f"setdest{setup_num}")],
+                [InlineKeyboardButton("✍️ Set Caption", callback_data=f"setdestcaption{setup_num}"),
+                 InlineKeyboardButton("🧪 Set Filters", callback_data=f"setfilters{setup_num}")],
+                [InlineKeyboardButton("✅ On", callback_data=f"on{setup_num}"),
+                 InlineKeyboardButton("⛔ Off", callback_data=f"off{setup_num}")],
+                [InlineKeyboardButton("👁️ View Setup", callback_data=f"viewsetup{setup_num}"),
+                 InlineKeyboardButton("🧹 Reset Setup", callback_data=f"resetsetup{setup_num}")],
+                [InlineKeyboardButton("🔙 Back to Auto Menu", callback_data="method_3")]
+            ]
+        
+            await update.message.reply_text(
+                f"✅ Filters saved for Auto {setup_num}!\n<pre>{escape(format_filter_rules(filter_rules))}</pre>\nChoose your next action:",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode="HTML"
+            )
+            return
+        
         # Inside your text handler
         if state.get("waiting_key") and state.get("current_method") == "method1":
             key = update.message.text.strip()
@@ -3810,11 +5684,21 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             keyboard = [
                 [InlineKeyboardButton("📡 Set Source", callback_data=f"setsource{setup_num}"),
                  InlineKeyboardButton("🎯 Set Destination", callback_data=f"setdest{setup_num}")],
-                [InlineKeyboardButton("✍️ Set Caption", callback_data=f"setdestcaption{setup_num}")]
+                [InlineKeyboardButton("✍️ Set Caption", callback_data=f"setdestcaption{setup_num}"),
+                 InlineKeyboardButton("🧪 Set Filters", callback_data=f"setfilters{setup_num}")],
+                [InlineKeyboardButton("🛰 Extra Destinations", callback_data=f"setextradest{setup_num}"),
+                 InlineKeyboardButton("⏱ Hold Window", callback_data=f"sethold{setup_num}")],
+                [InlineKeyboardButton("🚦 Load Limits", callback_data=f"setlimits{setup_num}")]
             ]
         
-            # Only show key mode buttons for Auto 1–3
-            if setup_num in ("1", "2", "3"):
+            # Key mode buttons only apply to single-post setups
+            mode = AUTO_SETUP.get(f"setup{setup_num}", {}).get("mode", "single")
+            shadow = AUTO_SETUP.get(f"setup{setup_num}", {}).get("shadow")
+            keyboard.append([
+                InlineKeyboardButton(f"🔁 Mode: {mode.capitalize()}", callback_data=f"setupmode{setup_num}"),
+                InlineKeyboardButton(f"🧪 Shadow: {'On' if shadow else 'Off'}", callback_data=f"shadow{setup_num}")
+            ])
+            if mode != "batch":
                 keyboard.append([
                     InlineKeyboardButton("🤖 Automated", callback_data=f"automated{setup_num}"),
                     InlineKeyboardButton("🧠 Key Manual", callback_data=f"manual{setup_num}")
@@ -3846,13 +5730,13 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
         # --- Handling Auto Setup Buttons ---
         if data == "method_3":
-            keyboard = [
-                [InlineKeyboardButton("⚙️ Auto 1", callback_data="auto1_menu"),
-                 InlineKeyboardButton("⚙️ Auto 2", callback_data="auto2_menu")],
-                [InlineKeyboardButton("⚙️ Auto 3", callback_data="auto3_menu"),
-                 InlineKeyboardButton("⚙️ Auto 4", callback_data="auto4_menu")],
-                [InlineKeyboardButton("🔙 Back to Methods", callback_data="back_to_methods")]
+            setup_buttons = [
+                InlineKeyboardButton(f"⚙️ Auto {parse_setup_number(name)}", callback_data=f"auto{parse_setup_number(name)}_menu")
+                for name in setup_names()
             ]
+            keyboard = [setup_buttons[i:i + 2] for i in range(0, len(setup_buttons), 2)]
+            keyboard.append([InlineKeyboardButton("➕ Add Setup", callback_data="addsetup")])
+            keyboard.append([InlineKeyboardButton("🔙 Back to Methods", callback_data="back_to_methods")])
             await query.edit_message_text(
                 "🛠 <b>Method 3 Activated!</b>\nChoose a setup to configure:",
                 parse_mode="HTML",
@@ -3907,8 +5791,50 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 disable_web_page_preview=True
             )
     
+        if data == "addsetup":
+            setup_num = parse_setup_number(add_setup())
+            save_config()
+            await query.edit_message_text(
+                text=f"➕ <b>Auto {setup_num} created</b>\nSelect an option to configure:",
+                parse_mode="HTML",
+                reply_markup=get_auto_keyboard(setup_num)
+            )
+            return
+    
+        if data.startswith("shadow"):
+            setup_num = parse_setup_number(data)
+            setup = AUTO_SETUP[f"setup{setup_num}"]
+            setup["shadow"] = not setup.get("shadow")
+            if setup["shadow"]:
+                # Each shadow run is a fresh benchmark
+                SHADOW_STATS.pop(f"setup{setup_num}", None)
+                LATENCY_STATS.pop(f"setup{setup_num}_shadow", None)
+            save_config()
+            await query.edit_message_text(
+                text=(
+                    f"🧪 Auto {setup_num} shadow mode <b>{'On' if setup['shadow'] else 'Off'}</b>."
+                    + ("\nLive posts run the full path but nothing is sent. See Settings → Auto-Setup → Shadow Report." if setup["shadow"] else "")
+                    + "\n\nChoose next action:"
+                ),
+                parse_mode="HTML",
+                reply_markup=get_auto_keyboard(setup_num)
+            )
+            return
+    
+        if data.startswith("setupmode"):
+            setup_num = parse_setup_number(data)
+            setup = AUTO_SETUP[f"setup{setup_num}"]
+            setup["mode"] = "batch" if setup.get("mode") != "batch" else "single"
+            save_config()
+            await query.edit_message_text(
+                text=f"🔁 Auto {setup_num} set to <b>{setup['mode'].capitalize()} Mode</b>.\n\nChoose next action:",
+                parse_mode="HTML",
+                reply_markup=get_auto_keyboard(setup_num)
+            )
+            return
+    
         if data.startswith("auto") and data.endswith("_menu"):
-            setup_num = data[4]
+            setup_num = parse_setup_number(data)
             await query.edit_message_text(
                 text=f"⚙️ <b>Auto {setup_num} Config</b>\nSelect an option to configure:",
                 parse_mode="HTML",
@@ -3917,25 +5843,92 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("setsource"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             USER_STATE[user_id]["status"] = f"waiting_source{setup_num}"
             await query.edit_message_text(f"📡 Send Source Channel ID for Auto {setup_num}", parse_mode="HTML")
             return
     
         if data.startswith("setdest") and not data.startswith("setdestcaption"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             USER_STATE[user_id]["status"] = f"waiting_dest{setup_num}"
             await query.edit_message_text(f"🎯 Send Destination Channel ID for Auto {setup_num}", parse_mode="HTML")
             return
     
+        if data.startswith("setextradest"):
+            setup_num = parse_setup_number(data)
+            USER_STATE[user_id]["status"] = f"waiting_extradest{setup_num}"
+            current = "\n".join(
+                f"{dest['channel']} | {dest['caption']}" if dest.get("caption") else dest["channel"]
+                for dest in AUTO_SETUP[f"setup{setup_num}"].get("extra_destinations") or []
+            ) or "none"
+            await query.edit_message_text(
+                f"🛰 Send extra destinations for Auto {setup_num}, one per line (or <code>clear</code>):\n"
+                f"<code>@channel\n"
+                f"-100xxxxxxxxxx | Own caption with Key -</code>\n"
+                f"Without a caption the main one is used.\n\n"
+                f"<b>Current:</b>\n<pre>{escape(current)}</pre>",
+                parse_mode="HTML"
+            )
+            return
+    
+        if data.startswith("setlimits"):
+            setup_num = parse_setup_number(data)
+            USER_STATE[user_id]["status"] = f"waiting_limits{setup_num}"
+            setup = AUTO_SETUP[f"setup{setup_num}"]
+            await query.edit_message_text(
+                f"🚦 Send load limits for Auto {setup_num}, one per line:\n"
+                f"<code>concurrent: 3\n"
+                f"queued: 20\n"
+                f"overflow: queue</code>\n"
+                f"Past <i>queued</i> open jobs: <b>queue</b> keeps taking posts quietly, "
+                f"<b>coalesce</b> posts the ones sharing a key together, <b>drop</b> discards and counts them.\n\n"
+                f"<b>Current:</b> concurrent {setup.get('max_concurrent', 3)}, queued {setup.get('max_queued', 20)}, "
+                f"overflow {setup.get('overflow', 'queue')}",
+                parse_mode="HTML"
+            )
+            return
+    
+        if data.startswith("sethold"):
+            setup_num = parse_setup_number(data)
+            USER_STATE[user_id]["status"] = f"waiting_hold{setup_num}"
+            setup = AUTO_SETUP[f"setup{setup_num}"]
+            await query.edit_message_text(
+                f"⏱ Send the hold window bounds for Auto {setup_num} in seconds, as <code>min-max</code>:\n"
+                f"<code>2-20</code>\n"
+                f"Posts wait about as long as this source takes to delete posts, within these bounds.\n\n"
+                f"<b>Current:</b> {setup.get('hold_min', 2):g}-{setup.get('hold_max', AUTO_HOLD_SECONDS):g}s, "
+                f"now {auto_hold_seconds(f'setup{setup_num}'):g}s",
+                parse_mode="HTML"
+            )
+            return
+    
+        if data.startswith("setfilters"):
+            setup_num = parse_setup_number(data)
+            USER_STATE[user_id]["status"] = f"waiting_filters{setup_num}"
+            current = format_filter_rules(AUTO_SETUP[f"setup{setup_num}"].get("filters") or {})
+            await query.edit_message_text(
+                f"🧪 Send filter rules for Auto {setup_num}, one per line (or <code>clear</code>):\n"
+                f"<code>min_size_mb: 1\n"
+                f"max_size_mb: 50\n"
+                f"extensions: .apk, .xapk\n"
+                f"mime_types: application/vnd.android.package-archive\n"
+                f"filename_regex: mod\n"
+                f"caption_regex: Key\\s*-\n"
+                f"caption_exclude_regex: beta\n"
+                f"senders: admin, @poster</code>\n\n"
+                f"<b>Current:</b>\n<pre>{escape(current)}</pre>",
+                parse_mode="HTML"
+            )
+            return
+    
         if data.startswith("setdestcaption"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             USER_STATE[user_id]["status"] = f"waiting_caption{setup_num}"
             await query.edit_message_text(f"✍️ Send Caption (must include 'Key -') for Auto {setup_num}", parse_mode="HTML")
             return
     
         if data.startswith("automated"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["key_mode"] = "auto"
             save_config()
             await query.edit_message_text(
@@ -3946,7 +5939,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("manual"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["key_mode"] = "manual"
             save_config()
             await query.edit_message_text(
@@ -3957,7 +5950,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("quote"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["style"] = "quote"
             save_config()
             await query.edit_message_text(
@@ -3968,7 +5961,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("mono"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["style"] = "mono"
             save_config()
             await query.edit_message_text(
@@ -3979,7 +5972,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("on"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["enabled"] = True
             save_config()
             await query.edit_message_text(
@@ -3990,7 +5983,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("off"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             AUTO_SETUP[f"setup{setup_num}"]["enabled"] = False
             save_config()
             await query.edit_message_text(
@@ -4000,30 +5993,8 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        if data == "auto4_menu":
-            keyboard = [
-                [InlineKeyboardButton("📡 Set Source", callback_data="setsource4"),
-                 InlineKeyboardButton("🎯 Set Destination", callback_data="setdest4")],
-                [InlineKeyboardButton("✍️ Set Caption", callback_data="setdestcaption4")],
-                [InlineKeyboardButton("🤖 Automated", callback_data="automated4"),
-                 InlineKeyboardButton("🧠 Key Manual", callback_data="manual4")],
-                [InlineKeyboardButton("📌 Quote Key", callback_data="quote4"),
-                 InlineKeyboardButton("🔤 Mono Key", callback_data="mono4")],
-                [InlineKeyboardButton("✅ On", callback_data="on4"),
-                 InlineKeyboardButton("⛔ Off", callback_data="off4")],
-                [InlineKeyboardButton("👁️ View Setup", callback_data="viewsetup4"),
-                 InlineKeyboardButton("🧹 Reset Setup", callback_data="resetsetup4")],
-                [InlineKeyboardButton("🔙 Back to Auto Menu", callback_data="method_3")]
-            ]
-            await query.edit_message_text(
-                text="⚙️ <b>Auto 4 Config</b>\nSelect an option to configure:",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup(keyboard)
-            )
-            return
-        
         if data.startswith("viewsetup"):
-            setup_num = data[-1]
+            setup_num = parse_setup_number(data)
             s = AUTO_SETUP.get(f"setup{setup_num}", {})
         
             total_keys = s.get("completed_count", 0)
@@ -4033,17 +6004,25 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             caption_ok = "✅" if s.get("dest_caption") else "❌"
             key_mode = s.get("key_mode", "auto").capitalize()
             style = s.get("style", "mono").capitalize()
+            mode = s.get("mode", "single").capitalize()
             status = "✅ ON" if s.get("enabled") else "⛔ OFF"
         
             msg = (
                 f"<pre>"
                 f"┌──── AUTO {setup_num} SYSTEM DIAG ─────┐\n"
+                f"│ MODE          >>  {mode}{' (shadow)' if s.get('shadow') else ''}\n"
                 f"│ SOURCE        >>  {source}\n"
                 f"│ DESTINATION   >>  {dest}\n"
+                f"│ EXTRA_DESTS   >>  {len(s.get('extra_destinations') or [])}\n"
                 f"│ CAPTION       >>  {caption_ok}\n"
                 f"│ KEY_MODE      >>  {key_mode}\n"
                 f"│ STYLE         >>  {style}\n"
                 f"│ STATUS        >>  {status}\n"
+                f"│ FILTERS       >>  {len(SETUP_FILTERS.get(f'setup{setup_num}', []))} rules\n"
+                f"│ REJECTED      >>  {sum(FILTER_REJECTIONS.get(f'setup{setup_num}', {}).values())}\n"
+                f"│ DUPLICATES    >>  {DEDUP_SKIPPED.get(f'setup{setup_num}', 0)}\n"
+                f"│ LOAD          >>  {s.get('max_concurrent', 3)}/{s.get('max_queued', 20)} {s.get('overflow', 'queue')}, dropped {OVERFLOW_DROPPED.get(f'setup{setup_num}', 0)}\n"
+                f"│ HOLD          >>  {auto_hold_seconds(f'setup{setup_num}'):g}s ({s.get('hold_min', 2):g}-{s.get('hold_max', AUTO_HOLD_SECONDS):g}s)\n"
                 f"│ KEYS_SENT     >>  {total_keys}\n"
                 f"│ TOTAL_APKS    >>  {total_apks} APK{'s' if total_apks != 1 else ''}\n"
                 f"└──────── END OF REPORT ────────┘"
@@ -4058,18 +6037,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
         if data.startswith("resetsetup"):
-            setup_num = data[-1]
-            AUTO_SETUP[f"setup{setup_num}"] = {
-                "source_channel": "",
-                "dest_channel": "",
-                "dest_caption": "",
-                "key_mode": "auto",
-                "style": "mono",
-                "enabled": False,
-                "completed_count": 0,
-                "processed_count": 0,
-                "last_key": ""
-            }
+            setup_num = parse_setup_number(data)
+            mode = AUTO_SETUP.get(f"setup{setup_num}", {}).get("mode", "single")
+            AUTO_SETUP[f"setup{setup_num}"] = new_setup(f"setup{setup_num}")
+            AUTO_SETUP[f"setup{setup_num}"]["mode"] = mode
+            HOLD_STATS.pop(f"setup{setup_num}", None)
+            LATENCY_STATS.pop(f"setup{setup_num}", None)
             save_config()
         
             msg = (
@@ -4213,12 +6186,12 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
         
             try:
-                result = await context.bot.send_document(
+                result = await deliver_post(pending["channel"], lambda: context.bot.send_document(
                     chat_id=pending["channel"],
                     document=pending["file_id"],
                     caption=pending["caption"],
                     parse_mode="HTML"
-                )
+                ))
         
                 # Update method1 stats
                 update_user_stats(user_id, method="method1", apks=1, keys=1)
@@ -4548,7 +6521,7 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 print(f"Error going back to Full Menu: {e}")
     
         if data.startswith("auto") and data.endswith("_menu"):
-            setup_num = data[4]  # auto1 → "1", auto2 → "2", auto3 → "3"
+            setup_num = parse_setup_number(data)  # auto1_menu → "1", auto12_menu → "12"
         
             keyboard = [
                 [
@@ -4732,8 +6705,6 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     f"└─ 🩺 Status: ⚠️ Error"
                 )
 
-            await asyncio.sleep(0.05)  # Throttle delay to prevent Timeouts
-
         # Summary report
         now = datetime.now(ZoneInfo("Asia/Kolkata"))
         date_str = now.strftime("%d-%m-%Y")
@@ -4779,7 +6750,7 @@ async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await notify_owner_on_error(context.bot, e, source="send_broadcast")
 
-async def auto_handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def auto_handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE, setup_name: str, shadow: bool = False):
     try:
         if not update.channel_post:
             return
@@ -4788,7 +6759,6 @@ async def auto_handle_channel_post(update: Update, context: ContextTypes.DEFAULT
         chat_id = str(message.chat.id)
         source_username = f"@{message.chat.username}" if message.chat.username else None
         doc = message.document
-        caption = message.caption or ""
     
         print(f"✅ Received channel post from {source_username or chat_id}")
     
@@ -4796,441 +6766,695 @@ async def auto_handle_channel_post(update: Update, context: ContextTypes.DEFAULT
             print("❌ No document attached.")
             return
     
-        if not doc.file_name.endswith(".apk"):
-            print("❌ Not an APK file. Ignoring.")
-            return
-    
-        file_size = doc.file_size
-        file_size_mb = file_size / (1024 * 1024)
-    
-        matched_setup = None
-        setup_number = None
-    
-        # Match Setup 1, 2, 3
-        for i in range(1, 4):
-            setup = AUTO_SETUP.get(f"setup{i}")
-            if not setup or not setup.get("source_channel"):
-                continue
-    
-            src = setup["source_channel"]
-    
-            if src.startswith("@") and source_username and src.lower() == source_username.lower():
-                matched_setup = setup
-                setup_number = i
-                break
-            elif src == chat_id:
-                matched_setup = setup
-                setup_number = i
-                break
-    
+        # Routed by SOURCE_INDEX/SHADOW_INDEX; unrouted_channel_post() reports switched-off ones
+        matched_setup = AUTO_SETUP.get(setup_name)
+        setup_number = parse_setup_number(setup_name)
         if not matched_setup:
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text="⚠️ *Alert!*\n➔ *No matching Auto Setup found for this APK!*\n⛔ *Processing Declined.*",
-                parse_mode="Markdown"
-            )
-            print("❌ No matching setup found. Message sent to owner.")
-            return
-    
-        if not matched_setup.get("enabled", False):
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=f"⚠️ *Alert!*\n➔ *Auto {setup_number} is currently OFF!*\n⛔ *Processing Declined.*",
-                parse_mode="Markdown"
-            )
-            print(f"❌ Auto {setup_number} is OFF. Message sent to owner.")
             return
     
         print(f"✅ Matched to Setup {setup_number}")
     
-        # Size filter
-        if setup_number == 1 and not (1 <= file_size_mb <= 50):
-            await context.bot.send_message(
-                chat_id=OWNER_ID,
-                text=f"⚠️ *Alert!*\n➔ *APK Size not matched for Auto {setup_number}*\n⛔ *Processing Declined.*",
-                parse_mode="Markdown"
-            )
-            print("❌ Size not matched. Message sent to owner.")
-            return
+        # Setup filters; rejections are only counted (see View Setup)
+        item = auto_job_item(message)
+        rule = rejected_by(setup_name, item)
+        if rule:
+            print(f"❌ Auto {setup_number}: rejected by {rule}")
+            if not shadow:
+                record_alert("rejected", f"Auto {setup_number}", f"{rule}: {item['file_name']}")
+            return
+    
+        # Later parts of an album join the job opened by the first part
+        window = f"{setup_name}:{chat_id}:album:{message.media_group_id}" if message.media_group_id else None
+        job = open_window_job(window) if window else None
+        if job:
+            job["items"].append(item)
+            save_auto_jobs()
+            print(f"✅ Added to {job['id']} ({len(job['items'])} APKs)")
+            return
+    
+        # Past the setup's intake limit its overflow policy decides
+        admission = admit_auto_post(setup_name)
+        if admission == "drop":
+            drop_auto_post(setup_name, source_username or chat_id)
+            return
+        if admission == "coalesce":
+            # Only posts carrying the same key share a job; it posts them like an album
+            key_mode = matched_setup.get("key_mode", "auto")
+            key = extract_key(item["caption"], item["caption_entities"], use_entities=(key_mode == "auto"))
+            if key:
+                window = f"{setup_name}:{chat_id}:overflow:{key}"
+                job = open_window_job(window)
+                if job:
+                    job["items"].append(item)
+                    save_auto_jobs()
+                    print(f"✅ Coalesced into {job['id']} ({len(job['items'])} APKs)")
+                    return
     
-        if setup_number == 2 and not (80 <= file_size_mb <= 2048):
-            await context.bot.send_message(
+        # Queue the post; the hold window, liveness check and posting run in the worker
+        now = time.time()
+        hold = auto_hold_seconds(setup_name)
+        job = {
+            "id": f"shadow:{setup_name}:{chat_id}:{message.message_id}" if shadow else f"{chat_id}:{message.message_id}",
+            "kind": "single",
+            "setup": setup_name,
+            "label": f"Auto {setup_number}",
+            "source_name": source_username or chat_id,
+            "window": window,
+            "items": [item],
+            "accepted_at": now,
+            "due": now + (max(hold, ALBUM_COLLECT_SECONDS) if window else hold),
+            "status_msg_id": None,
+            "shadow": shadow
+        }
+        enqueue_auto_job(job)
+        if should_watch_deletions(setup_name):
+            context.application.create_task(watch_deletions(context.bot, job))
+        if not shadow and admission != "queue":  # overflow posts report only their result
+            context.application.create_task(auto_job_countdown(context.bot, job))
+        print(f"✅ Queued {job['id']} for Setup {setup_number}")
+
+    except Exception as e:
+        await notify_owner_on_error(context.bot, e, source="auto_handle_channel_post")
+
+def auto_job_item(message) -> dict:
+    """Snapshot the parts of a channel post the auto pipeline needs, in JSON-safe form."""
+    doc = message.document
+    return {
+        "chat_id": message.chat_id,
+        "message_id": message.message_id,
+        "file_id": doc.file_id,
+        "file_name": doc.file_name or "",
+        "file_size": doc.file_size or 0,
+        "file_unique_id": doc.file_unique_id,
+        "mime_type": doc.mime_type,
+        "sender": message.author_signature or (message.from_user.username if message.from_user else None),
+        "caption": message.caption or "",
+        "caption_entities": [e.to_dict() for e in message.caption_entities or []]
+    }
+
+async def set_auto_status(bot, job: dict, text: str, parse_mode: str = "HTML", **kwargs):
+    """Edit the owner status message of a job, or send one if it was never posted."""
+    if job.get("shadow"):
+        return  # shadow jobs report through the Shadow Report screen only
+    if job.get("status_msg_id"):
+        untrack_progress(OWNER_ID, job["status_msg_id"])
+        try:
+            await bot.edit_message_text(
                 chat_id=OWNER_ID,
-                text=f"⚠️ *Alert!*\n➔ *APK Size not matched for Auto {setup_number}*\n⛔ *Processing Declined.*",
-                parse_mode="Markdown"
+                message_id=job["status_msg_id"],
+                text=text,
+                parse_mode=parse_mode,
+                **kwargs
             )
-            print("❌ Size not matched. Message sent to owner.")
             return
-    
-        # Save for later deletion check
-        source_chat_id = message.chat_id
-        message_id = message.message_id
-    
-        # Initial waiting message with full bar
-        countdown_msg = await context.bot.send_message(
+        except Exception as e:
+            print(f"[AUTO] Status edit failed for {job['id']}: {e}")
+    sent = await bot.send_message(chat_id=OWNER_ID, text=text, parse_mode=parse_mode, **kwargs)
+    job["status_msg_id"] = sent.message_id
+
+async def auto_job_countdown(bot, job: dict):
+    """Show the hold window to the owner while the job sits in the delay queue."""
+    try:
+        label = job["label"]
+        if job.get("parked"):
+            await set_auto_status(bot, job, f"<b>⏸ {label} - Parked</b>\nEvery destination is paused; it posts once one recovers.")
+            return
+        if job.get("started") or job["id"] not in AUTO_JOBS:
+            return  # a short hold can run out before the countdown gets going
+        hold = max(1, int(job["due"] - job["accepted_at"]))
+        sent = await bot.send_message(
             chat_id=OWNER_ID,
-            text=f"⏳ *Auto {setup_number} - Waiting...*\n`[▰▰▰▰▰▰▰▰▰▰▱▱▱▱▱▱▱▱▱▱] (0/20)`",
-            parse_mode="Markdown"
+            text=f"<b>⏳ {label} - Waiting...</b>\n<code>[{'▱' * 20}] (0/{hold})</code>",
+            parse_mode="HTML"
         )
-    
-        # Countdown loop with progress bar
-        for elapsed in range(1, 21):
-            await asyncio.sleep(1)
-    
-            # Visual bar
-            filled = "▰" * elapsed
-            empty = "▱" * (20 - elapsed)
-            bar = filled + empty
-    
+        if job.get("status_msg_id") or job["id"] not in AUTO_JOBS:
+            # The job reported (or finished) while this was being sent: drop the stale countdown
             try:
-                await context.bot.edit_message_text(
-                    chat_id=OWNER_ID,
-                    message_id=countdown_msg.message_id,
-                    text=f"⏳ *Auto {setup_number} - Waiting...*\n`[{bar}] ({elapsed}/20)`",
-                    parse_mode="Markdown"
-                )
-            except:
+                await bot.delete_message(chat_id=OWNER_ID, message_id=sent.message_id)
+            except Exception:
                 pass
-    
-        # Check if source message still exists
+            return
+        job["status_msg_id"] = sent.message_id  # set_auto_status() edits it into the result
+        if job.get("started"):
+            return
+
+        def render(now):
+            elapsed = min(hold, int(now - job["accepted_at"]))
+            filled = elapsed * 20 // hold
+            bar = "▰" * filled + "▱" * (20 - filled)
+            return f"<b>⏳ {label} - Waiting...</b>\n<code>[{bar}] ({elapsed}/{hold})</code>"
+
+        # Further redraws come from the progress ticker; set_auto_status() takes the message back
+        track_progress(OWNER_ID, sent.message_id, render, job["due"])
+
+    except Exception as e:
+        print(f"[AUTO] Countdown failed for {job['id']}: {e}")
+
+async def auto_queue_worker(application: Application):
+    """Single consumer of the delay queue: waits for the earliest due job and starts it."""
+    while True:
         try:
-            await context.bot.forward_message(chat_id=OWNER_ID, from_chat_id=source_chat_id, message_id=message_id)
-            print("✅ Message exists after 20s.")
+            if not AUTO_QUEUE:
+                auto_queue_event.clear()
+                await auto_queue_event.wait()
+                continue
+
+            due, _, job_id = AUTO_QUEUE[0]
+            delay = due - time.time()
+            if delay > 0:
+                auto_queue_event.clear()
+                try:
+                    await asyncio.wait_for(auto_queue_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(AUTO_QUEUE)
+            job = AUTO_JOBS.get(job_id)
+            if not job or job.get("started") or job.get("parked"):
+                continue
+            if job_blocked(job):
+                job["parked"] = True  # destinations went down during the hold; skip the probe
+                close_window(job)
+                release_job_posts(job)
+                save_auto_jobs()
+                continue
+
+            job["started"] = True
+            close_window(job)
+            application.create_task(run_auto_job(application.bot, job))
+
         except Exception as e:
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text=f"❌ *Auto {setup_number} Declined*\n➔ *Message Deleted during 20s wait.*",
+            await notify_owner_on_error(application.bot, e, source="auto_queue_worker")
+            await asyncio.sleep(1)
+
+async def run_auto_job(bot, job: dict):
+    if job.get("shadow"):
+        bot = ShadowBot(bot, job)
+    try:
+        if job["status"] == "pending":
+            record_latency(latency_name(job), "hold", time.time() - job["accepted_at"])
+        slot_start = time.time()
+        async with setup_slots(job["setup"]):
+            record_latency(latency_name(job), "slot", time.time() - slot_start)
+            AUTO_RUNNING.add(job["id"])
+            if job["kind"] == "batch":
+                await process_auto_batch(bot, job)
+            else:
+                await process_auto_job(bot, job)
+    finally:
+        AUTO_RUNNING.discard(job["id"])
+        release_job_posts(job)
+        close_window(job)
+        if job_blocked(job):
+            job["parked"] = True  # stays in the store until its destinations recover
+        else:
+            AUTO_JOBS.pop(job["id"], None)
+        save_auto_jobs()
+        if job.get("shadow"):
+            stats = shadow_stats(job["setup"])
+            stats["jobs"] += 1
+            stats["posted" if job["status"] == "posting" else "declined"] += 1
+
+async def process_auto_job(bot, job: dict):
+    try:
+        setup_number = parse_setup_number(job["setup"])
+        matched_setup = AUTO_SETUP.get(job["setup"], {})
+
+        if job["status"] == "posting":
+            items = job["items"]  # resumed after a restart: already checked and keyed
+        else:
+            # Check which source messages (one, or every part of an album) still exist
+            probe_start = time.time()
+            items = await check_source_posts(bot, job)
+            record_latency(latency_name(job), "probe", time.time() - probe_start)
+        if not items:
+            await set_auto_status(
+                bot, job,
+                f"❌ *Auto {setup_number} Declined*\n➔ *Message Deleted during {int(job['due'] - job['accepted_at'])}s wait.*",
                 parse_mode="Markdown"
             )
             print("❌ Message deleted during delay. Skipped.")
             return
+        print(f"✅ {len(items)}/{len(job['items'])} messages exist after hold window.")
     
         # Now Extract Key
         key_mode = matched_setup.get("key_mode", "auto")
         style = matched_setup.get("style", "mono")
-        dest_caption = matched_setup.get("dest_caption", "")
-        dest_channel = matched_setup.get("dest_channel", "")
-    
-        key = None
-    
-        if key_mode == "auto":
-            # Step 1: Try "Key -" pattern in caption text
-            match = re.search(r'Key\s*-\s*(\S+)', caption)
-            if match:
-                key = match.group(1)
-        
-            # Step 2: If not found, check for 'code' style entity (One Tap Copy)
-            if not key and message.caption_entities:
-                for entity in message.caption_entities:
-                    if entity.type == "code":
-                        offset = entity.offset
-                        length = entity.length
-                        key = caption[offset:offset + length]
-                        break  # Stop after first match
-        
-        elif key_mode == "manual":
-            match = re.search(r'Key\s*-\s*(\S+)', caption)
-            if match:
-                key = match.group(1)
+        destinations = setup_destinations(matched_setup)
+    
+        key = job.get("key")
+        if not key and key_mode in ("auto", "manual"):
+            # "Key -" pattern first; auto mode also accepts a 'code' entity (One Tap Copy)
+            key_start = time.time()
+            for item in items:
+                key = extract_key(item["caption"], item["caption_entities"], use_entities=(key_mode == "auto"))
+                if key:
+                    break
+            record_latency(latency_name(job), "key", time.time() - key_start)
     
         if not key:
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text=f"❌ *Auto {setup_number} Declined*\n➔ *Key not extracted.*",
+            await set_auto_status(
+                bot, job,
+                f"❌ *Auto {setup_number} Declined*\n➔ *Key not extracted.*",
                 parse_mode="Markdown"
             )
             print("❌ Key missing. Skipped.")
             return
     
-        # Prepare Destination Caption
-        if "Key -" not in dest_caption:
-            dest_caption += "\nKey -"
-    
-        if style == "quote":
-            final_caption = dest_caption.replace("Key -", f"<blockquote>Key - <code>{key}</code></blockquote>")
-        else:  # mono
-            final_caption = dest_caption.replace("Key -", f"Key - <code>{key}</code>")
-    
-        # Send document
-        try:
-            sent_msg = await context.bot.send_document(
-                chat_id=dest_channel,
-                document=doc.file_id,
-                caption=final_caption,
-                parse_mode="HTML",
-                disable_notification=True
+        if not destinations:
+            await set_auto_status(
+                bot, job,
+                f"❌ *Auto {setup_number} Declined*\n➔ *No destination channel set.*",
+                parse_mode="Markdown"
             )
+            return
     
-            matched_setup["completed_count"] += 1
-            save_config()
-    
-            # Post link generator
-            if str(dest_channel).startswith("@"):
-                post_link = f"https://t.me/{dest_channel.strip('@')}/{sent_msg.message_id}"
-            elif str(dest_channel).startswith("-100"):
-                post_link = f"https://t.me/c/{str(dest_channel)[4:]}/{sent_msg.message_id}"
-            else:
-                post_link = "Unknown"
-    
-            def escape(text):
-                return re.sub(r'([_\*~`>\#+\-=|{}.!])', r'\\\1', str(text))
-    
-            source_name = source_username if source_username else chat_id
-            source = escape(source_name)
-            dest = escape(dest_channel)
-            key_escape = escape(key)
-            post_link_escape = escape(post_link)
-    
-            # Final success message
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text=(
-                    f"✅ *Auto {setup_number} Completed*\n"
-                    f"├─ 👤 Source : {source}\n"
-                    f"├─ 🎯 Destination : {dest}\n"
-                    f"├─ 📡 Key : `{key_escape}`\n"
-                    f"└─ 🔗 Post Link : [Click Here]({post_link_escape})"
-                ),
-                parse_mode="MarkdownV2",
-                disable_web_page_preview=True
+        # Prepare Destination Caption
+        def build_caption(dest_caption):
+            if "Key -" not in dest_caption:
+                dest_caption += "\nKey -"
+            if style == "quote":
+                return dest_caption.replace("Key -", f"<blockquote>Key - <code>{key}</code></blockquote>")
+            return dest_caption.replace("Key -", f"Key - <code>{key}</code>")  # mono
+    
+        # A destination that got the same APK and key recently is skipped
+        destinations, duplicates = claim_uploads(job, destinations, items, key)
+        if not destinations:
+            await set_auto_status(
+                bot, job,
+                f"⏭ *Auto {setup_number} Skipped*\n➔ *Same APK and key were posted recently.*",
+                parse_mode="Markdown"
             )
+            print("⏭ Duplicate for every destination. Skipped.")
+            return
     
-            print("✅ Successfully forwarded and notified owner.")
+        # Send the document(s) to every destination at once; an album goes out as one media group
+        job["items"], job["key"] = items, key
+
+        async def post_to(dest):
+            file_ids = [item["file_id"] for item in dest["items"]]
+            captions = [build_caption(dest["caption"])] * len(file_ids)
+            sent = []
+            dest.update(file_ids=file_ids, captions=captions, sent=sent)
+
+            async def send():
+                # A retry picks up after the files that already went out
+                done = len(sent)
+                await send_album(bot, dest["channel"], file_ids[done:], captions[done:], sent, disable_notification=True)
+
+            try:
+                await deliver_post(
+                    post_queue_key(job, dest["channel"]),
+                    lambda: send_with_retry(send, f"{job['id']} -> {dest['channel']}"),
+                    job_ticket(job, dest["channel"])
+                )
+            except Exception:
+                if not sent:
+                    release_uploads(job, dest, key)
+                raise
+            return sent[0].message_id
+
+        send_start = time.time()
+        results = await post_auto_destinations(bot, job, destinations, post_to)
+        record_latency(latency_name(job), "send", time.time() - send_start)
+        await remember_posts(bot, job, destinations, key, use_entities=(key_mode == "auto"))
+    
+        def escape(text):
+            return re.sub(r'([_\*\[\]()~`>\#+\-=|{}.!])', r'\\\1', str(text))
+    
+        lines = []
+        posted = 0
+        for dest, result in zip(destinations, results):
+            if isinstance(result, DestinationParked):
+                lines.append(f"├─ ⏸ {escape(dest['channel'])} : paused, posts on recovery")
+            elif isinstance(result, Exception):
+                lines.append(f"├─ ❌ {escape(dest['channel'])} : {escape(result)}")
+                print(f"❌ Error while sending document to {dest['channel']}: {result}")
+            else:
+                posted += 1
+                lines.append(f"├─ 🎯 {escape(dest['channel'])} : [Post]({escape(auto_post_link(dest['channel'], result))})")
+        for dest in duplicates:
+            lines.append(f"├─ ⏭ {escape(dest['channel'])} : duplicate, skipped")
+    
+        if posted:
+            record_latency(latency_name(job), "total", time.time() - job["accepted_at"])
+        if posted and not job.get("shadow"):
+            matched_setup["completed_count"] = matched_setup.get("completed_count", 0) + 1
+            save_config()
     
-        except Exception as e:
-            error_message = traceback.format_exc()
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text=f"❌ *Error Sending APK!*\n\n`{error_message}`",
-                parse_mode="MarkdownV2"
-            )
-            print("❌ Error while sending document:\n", error_message)
+        if posted == len(destinations):
+            title = f"✅ *Auto {setup_number} Completed*"
+        elif all(isinstance(result, DestinationParked) for result in results):
+            title = f"⏸ *Auto {setup_number} Parked*"
+        elif posted:
+            title = f"⚠️ *Auto {setup_number} Partially Completed* \\({posted}/{len(destinations)}\\)"
+        else:
+            title = "❌ *Error Sending APK\\!*"
+    
+        # One summary for all destinations
+        await set_auto_status(
+            bot, job,
+            (
+                f"{title}\n"
+                f"├─ 👤 Source : {escape(job['source_name'])}\n"
+                + "\n".join(lines) + "\n"
+                f"└─ 📡 Key : `{escape(key)}`"
+            ),
+            parse_mode="MarkdownV2",
+            disable_web_page_preview=True
+        )
+        print(f"✅ Posted to {posted}/{len(destinations)} destinations and notified owner.")
 
     except Exception as e:
-        await notify_owner_on_error(context.bot, e, source="auto_handle_channel_post")
+        await notify_owner_on_error(bot, e, source="process_auto_job")
 
-async def auto4_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def auto_batch_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, setup_name: str, shadow: bool = False):
     try:
         message = update.effective_message
         doc = message.document
     
-        if not doc or not doc.file_name.lower().endswith(".apk"):
+        if not doc:
             return
     
         chat_id = str(update.effective_chat.id)
-        source_channel = str(AUTO_SETUP["setup4"].get("source_channel"))
-    
-        if chat_id != source_channel or not AUTO_SETUP["setup4"].get("enabled", False):
-            return
-    
-        caption = message.caption or ""
-    
-        AUTO4_STATE["pending_apks"].append({
-            "file_id": doc.file_id,
-            "caption": caption,
-            "message_id": message.message_id,
-            "chat_id": chat_id,
-            "timestamp": time.time(),
-            "caption_entities": message.caption_entities and [e.to_dict() for e in message.caption_entities]
-        })
+        setup_number = parse_setup_number(setup_name)
+    
+        item = auto_job_item(message)
+        rule = rejected_by(setup_name, item)
+        if rule:
+            print(f"❌ Auto {setup_number}: rejected by {rule}")
+            if not shadow:
+                record_alert("rejected", f"Auto {setup_number}", f"{rule}: {item['file_name']}")
+            return
+    
+        # Each source has its own burst window; once that job starts, the next APK opens a new one
+        window = f"{setup_name}:{chat_id}:burst"
+        job = open_window_job(window)
+        if job:
+            job["items"].append(item)
+            save_auto_jobs()
+            return
+    
+        # Past the setup's intake limit its overflow policy decides
+        admission = admit_auto_post(setup_name)
+        if admission == "drop":
+            drop_auto_post(setup_name, chat_id)
+            return
+        if admission == "coalesce":
+            window = f"{setup_name}:{chat_id}:overflow"
+            job = open_window_job(window)
+            if job:
+                job["items"].append(item)
+                save_auto_jobs()
+                return
     
-        if not AUTO4_STATE["timer"]:
-            AUTO4_STATE["waiting_since"] = time.time()
-            AUTO4_STATE["timer"] = asyncio.create_task(process_auto4_delayed(context))
+        job = {
+            "id": f"{setup_name}:{chat_id}:{message.message_id}",
+            "kind": "batch",
+            "setup": setup_name,
+            "label": f"Auto {setup_number}",
+            "source_name": chat_id,
+            "window": window,
+            "items": [item],
+            "accepted_at": time.time(),
+            "due": time.time() + auto_hold_seconds(setup_name),
+            "status_msg_id": None,
+            "shadow": shadow
+        }
+        enqueue_auto_job(job)
+        if should_watch_deletions(setup_name):
+            context.application.create_task(watch_deletions(context.bot, job))
+        if not shadow and admission != "queue":  # overflow posts report only their result
+            context.application.create_task(auto_job_countdown(context.bot, job))
 
     except Exception as e:
-        await notify_owner_on_error(context.bot, e, source="auto4_message_handler")
+        await notify_owner_on_error(context.bot, e, source="auto_batch_handler")
 
-async def process_auto4_delayed(context: ContextTypes.DEFAULT_TYPE):
+async def process_auto_batch(bot, job: dict):
+    label = job["label"]
     try:
-        countdown_msg = await context.bot.send_message(
-            OWNER_ID,
-            "<b>⏳ Auto 4 - Waiting...</b>\n"
-            "<code>[▰▰▰▰▰▰▰▰▰▰▱▱▱▱▱▱▱▱▱▱] (0/20)</code>",
-            parse_mode="HTML"
-        )
-
-        for elapsed in range(1, 21):
-            await asyncio.sleep(1)
-
-            filled = "▰" * elapsed
-            empty = "▱" * (20 - elapsed)
-            bar = filled + empty
-
-            try:
-                await context.bot.edit_message_text(
-                    chat_id=OWNER_ID,
-                    message_id=countdown_msg.message_id,
-                    text=(
-                        "<b>⏳ Auto 4 - Waiting...</b>\n"
-                        f"<code>[{bar}] ({elapsed}/20)</code>"
-                    ),
-                    parse_mode="HTML"
-                )
-            except Exception:
-                pass
-
-        await asyncio.sleep(1)
-
-        source_channel = AUTO_SETUP["setup4"]["source_channel"]
-        valid_apks = []
+        if job["status"] == "posting":
+            # Resumed after a restart: the burst was already checked and keyed
+            await send_auto_batch(job["items"], job["key"], bot, job, job["setup_type"])
+            return
 
-        for apk in AUTO4_STATE["pending_apks"]:
-            try:
-                await context.bot.forward_message(
-                    chat_id=OWNER_ID,
-                    from_chat_id=source_channel,
-                    message_id=apk["message_id"]
-                )
-                valid_apks.append(apk)
-            except Exception:
-                pass
+        # job["items"] is this burst only; APKs arriving now already belong to the next window
+        probe_start = time.time()
+        valid_apks = await check_source_posts(bot, job)
+        record_latency(latency_name(job), "probe", time.time() - probe_start)
 
         if not valid_apks:
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text="❌ <b>Auto 4: All APKs deleted. Declined.</b>",
-                parse_mode="HTML"
-            )
+            await set_auto_status(bot, job, f"❌ <b>{label}: All APKs deleted. Declined.</b>")
             return
 
         key = None
         setup_type = "Setup 1" if len(valid_apks) == 1 else "Setup 2"
 
         # Key extraction
+        key_start = time.time()
         await asyncio.sleep(3 if setup_type == "Setup 2" else 0)
         for apk in (valid_apks[::-1] if setup_type == "Setup 2" else valid_apks):
-            caption = apk["caption"]
-            match = re.search(r'Key\s*-\s*(\S+)', caption)
-            if match:
-                key = match.group(1)
-                break
-            if "caption_entities" in apk:
-                for entity in apk["caption_entities"]:
-                    if entity["type"] == "code":
-                        offset = entity["offset"]
-                        length = entity["length"]
-                        key = caption[offset:offset + length]
-                        break
+            key = extract_key(apk["caption"], apk.get("caption_entities"))
             if key:
                 break
+        record_latency(latency_name(job), "key", time.time() - key_start)
 
         if key:
-            await send_auto4_apks(valid_apks, key, context, countdown_msg, setup_type)
+            job["items"], job["key"], job["setup_type"] = valid_apks, key, setup_type
+            await send_auto_batch(valid_apks, key, bot, job, setup_type)
         else:
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text=f"❌ <b>Auto 4 {setup_type}: No key found in any APK.</b>",
-                parse_mode="HTML"
-            )
+            await set_auto_status(bot, job, f"❌ <b>{label} {setup_type}: No key found in any APK.</b>")
 
     except Exception as e:
-        await notify_owner_on_error(context.bot, e, source="process_auto4_delayed")
-        
-    finally:
-        AUTO4_STATE.update({
-            "pending_apks": [],
-            "timer": None,
-            "setup_mode": 1,
-            "waiting_since": None
-        })
+        await notify_owner_on_error(bot, e, source="process_auto_batch")
     
-async def send_auto4_apks(apks, key, context: ContextTypes.DEFAULT_TYPE, countdown_msg, setup_type):
+async def send_auto_batch(apks, key, bot, job: dict, setup_type):
     try:
-        dest_channel = AUTO_SETUP["setup4"].get("dest_channel")
-        caption_template = AUTO_SETUP["setup4"].get("dest_caption")
-        style = AUTO_SETUP["setup4"].get("style", "mono")
-        source_channel = AUTO_SETUP["setup4"].get("source_channel")
+        setup = AUTO_SETUP.get(job["setup"], {})
+        label = job["label"]
+        style = setup.get("style", "mono")
+        source_channel = setup.get("source_channel")
+        destinations = [dest for dest in setup_destinations(setup) if dest["caption"]]
     
-        if not dest_channel or not caption_template:
-            await context.bot.edit_message_text(
-                chat_id=OWNER_ID,
-                message_id=countdown_msg.message_id,
-                text="❌ <b>Auto4: Destination channel or caption missing.</b>",
-                parse_mode="HTML"
-            )
+        if not destinations:
+            await set_auto_status(bot, job, f"❌ <b>{label}: Destination channel or caption missing.</b>")
             return
     
-        post_link = "Unavailable"
-        success_count = 0
+        # A destination that got the same APKs and key recently is skipped
+        destinations, duplicates = claim_uploads(job, destinations, apks, key)
+        if not destinations:
+            await set_auto_status(bot, job, f"⏭ <b>{label}: Same APKs and key were posted recently. Skipped.</b>")
+            return
     
-        for apk in apks:
+        async def post_to(dest):
+            file_ids = [apk["file_id"] for apk in dest["items"]]
             if style == "quote":
                 caption_final = f"<blockquote>Key - <code>{key}</code></blockquote>"
             else:
-                caption_final = caption_template.replace("Key -", f"Key - <code>{key}</code>")
+                caption_final = dest["caption"].replace("Key -", f"Key - <code>{key}</code>")
     
+            captions = [caption_final] * len(file_ids)
+            sent = []
+            dest.update(file_ids=file_ids, captions=captions, sent=sent)
+
+            async def send():
+                # A retry picks up after the files that already went out
+                done = len(sent)
+                if ALBUM_POSTING:
+                    await send_album(bot, dest["channel"], file_ids[done:], captions[done:], sent)
+                else:
+                    for file_id in file_ids[done:]:
+                        sent.append(await bot.send_document(
+                            chat_id=dest["channel"],
+                            document=file_id,
+                            caption=caption_final,
+                            parse_mode="HTML"
+                        ))
+
             try:
-                msg = await context.bot.send_document(
-                    chat_id=dest_channel,
-                    document=apk["file_id"],
-                    caption=caption_final,
-                    parse_mode="HTML"
+                await deliver_post(
+                    post_queue_key(job, dest["channel"]),
+                    lambda: send_with_retry(send, f"{job['id']} -> {dest['channel']}"),
+                    job_ticket(job, dest["channel"])
                 )
-                if post_link == "Unavailable":
-                    post_link = f"https://t.me/c/{str(dest_channel).lstrip('-100')}/{msg.message_id}"
-                success_count += 1
-            except Exception as e:
-                await context.bot.send_message(OWNER_ID, f"❌ Failed to send APK: <code>{e}</code>", parse_mode="HTML")
+            except Exception:
+                if not sent:
+                    release_uploads(job, dest, key)
+                raise
+            return sent[0].message_id
+    
+        # Every destination is posted concurrently; results come back in destination order
+        send_start = time.time()
+        results = await post_auto_destinations(bot, job, destinations, post_to)
+        record_latency(latency_name(job), "send", time.time() - send_start)
+        await remember_posts(bot, job, destinations, key)
+    
+        lines = []
+        posted = 0
+        for dest, result in zip(destinations, results):
+            if isinstance(result, DestinationParked):
+                lines.append(f"├─ ⏸ <code>{dest['channel']}</code> : paused, posts on recovery")
+            elif isinstance(result, Exception):
+                lines.append(f"├─ ❌ <code>{dest['channel']}</code> : <code>{escape(str(result))}</code>")
+            else:
+                posted += 1
+                lines.append(f"├─ 🎯 <code>{dest['channel']}</code> : <a href='{auto_post_link(dest['channel'], result)}'>Post</a>")
+        for dest in duplicates:
+            lines.append(f"├─ ⏭ <code>{dest['channel']}</code> : duplicate, skipped")
+    
+        if posted:
+            record_latency(latency_name(job), "total", time.time() - job["accepted_at"])
+        if posted and not job.get("shadow"):
+            setup["completed_count"] = setup.get("completed_count", 0) + 1
+            save_config()
     
-        AUTO_SETUP["setup4"]["completed_count"] += 1
-        save_config()
+        if posted == len(destinations):
+            title = f"✅ <b>{label} Completed</b>"
+        elif all(isinstance(result, DestinationParked) for result in results):
+            title = f"⏸ <b>{label} Parked</b>"
+        elif posted:
+            title = f"⚠️ <b>{label} Partially Completed</b> ({posted}/{len(destinations)})"
+        else:
+            title = f"❌ <b>{label}: Failed to send APKs</b>"
     
         summary = (
-            f"✅ <b>Auto 4 Completed</b>\n"
+            f"{title}\n"
             f"├─ 👤 Source : <code>{source_channel}</code>\n"
-            f"├─ 🎯 Destination : <code>{dest_channel}</code>\n"
-            f"├─ 📡 Key : <code>{key}</code>\n"
-            f"└─ 🔗 Post Link : <a href='{post_link}'>Click Here</a>"
+            + "\n".join(lines) + "\n"
+            f"└─ 📡 Key : <code>{key}</code>"
         )
         
-        await context.bot.edit_message_text(
-            chat_id=OWNER_ID,
-            message_id=countdown_msg.message_id,
-            text=summary,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
+        await set_auto_status(bot, job, summary, disable_web_page_preview=True)
 
     except Exception as e:
-        await notify_owner_on_error(context.bot, e, source="send_auto4_apks")
+        await notify_owner_on_error(bot, e, source="send_auto_batch")
 
 async def unified_auto_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chat_id = str(update.effective_chat.id)
+    # SourceChatFilter already dropped posts from chats no setup listens to
+    setup_name = route_source(update.effective_chat)
 
-    # AUTO 4
-    setup4 = AUTO_SETUP.get("setup4", {})
-    if setup4.get("enabled") and chat_id == str(setup4.get("source_channel", "")):
-        await auto4_message_handler(update, context)
-        return
+    # Shadow setups see the same posts as the live one but only record what they would post
+    routes = [(name, True) for name in shadow_routes(update.effective_chat)]
+    if setup_name:
+        routes.append((setup_name, False))
 
-    # AUTO 1–3
-    for i in range(1, 4):
-        setup = AUTO_SETUP.get(f"setup{i}", {})
-        if setup.get("enabled") and chat_id == str(setup.get("source_channel", "")):
-            await auto_handle_channel_post(update, context)
-            return
+    for name, shadow in routes:
+        if AUTO_SETUP[name].get("mode") == "batch":
+            await auto_batch_handler(update, context, name, shadow)
+        else:
+            await auto_handle_channel_post(update, context, name, shadow)
+
+async def auto_edit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Edited APK posts from a source chat: key rotations reach the destination posts
+    message = update.edited_channel_post
+    try:
+        rotation = apply_caption_edit(message)
+        if rotation:
+            # The edits wait in the destination queues; the source chat's next posts must not wait with them
+            context.application.create_task(rotate_posted_key(context.bot, *rotation))
+    except Exception as e:
+        await notify_owner_on_error(context.bot, e, source="auto_edit_handler")
 
-    print(f"[AUTO] Skipped: {chat_id} not in any setup")
+async def unrouted_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # APK posts in the source of a switched-off setup (DisabledSourceFilter); any other channel is none of our business
+    chat = update.effective_chat
+    try:
+        source = f"@{chat.username}" if chat.username else str(chat.id)
+        setup_name = DISABLED_INDEX.get(str(chat.id))
+        if setup_name is None and chat.username:
+            setup_name = DISABLED_INDEX.get(f"@{chat.username.lower()}")
+        record_alert("setup_off", f"Auto {parse_setup_number(setup_name)}", source)
+        print(f"❌ Auto {parse_setup_number(setup_name)} is OFF. Queued for the owner digest.")
+    except Exception as e:
+        await notify_owner_on_error(context.bot, e, source="unrouted_channel_post")
+
+ALERT_KINDS = {
+    "error": "❗ Errors",
+    "setup_off": "⛔ Setup is OFF",
+    "rejected": "🧪 Rejected by filters",
+    "overflow": "🚦 Dropped by overflow",
+    "dead_letter": "📮 Failed posts kept for replay"
+}
+
+def record_alert(kind: str, source, detail: str = ""):
+    """Group an owner-facing event by kind and source until the next digest."""
+    now = time.time()
+    alert = ALERTS.setdefault(f"{kind}|{source}", {
+        "kind": kind, "source": str(source), "count": 0,
+        "first_at": now, "first_detail": detail
+    })
+    alert["count"] += 1
+    alert["last_at"] = now
+    alert["last_detail"] = detail
+
+def format_alert_digest(alerts: list) -> list:
+    """Digest text for the owner, split into messages that fit Telegram's limit."""
+    def clock(ts):
+        return datetime.fromtimestamp(ts, ZoneInfo("Asia/Kolkata")).strftime("%H:%M:%S")
+
+    blocks = []
+    for kind, label in ALERT_KINDS.items():
+        group = [alert for alert in alerts if alert["kind"] == kind]
+        if not group:
+            continue
+        lines = [f"<b>{label}</b>"]
+        for alert in sorted(group, key=lambda a: -a["count"]):
+            when = clock(alert["first_at"]) if alert["count"] == 1 else f"{clock(alert['first_at'])}–{clock(alert['last_at'])}"
+            lines.append(f"• <code>{escape(alert['source'])}</code> ×{alert['count']} ({when})")
+            if kind == "error":
+                lines.append(f"<pre>{escape(alert['first_detail'])}</pre>")
+                if alert["count"] > 1 and alert["last_detail"] != alert["first_detail"]:
+                    lines.append(f"<i>last:</i>\n<pre>{escape(alert['last_detail'])}</pre>")
+            elif alert.get("last_detail"):
+                lines.append(f"  ↳ {escape(alert['last_detail'][:100])}")
+        blocks.append("\n".join(lines))
+
+    messages, current = [], "📬 <b>Alert digest</b>"
+    for block in blocks:
+        if len(current) + len(block) + 2 > 4000:
+            messages.append(current)
+            current = block[:4000]
+        else:
+            current += "\n\n" + block
+    messages.append(current)
+    return messages
+
+async def alert_digest_task(bot):
+    while True:
+        await asyncio.sleep(ALERT_DIGEST_INTERVAL)
+        if not ALERTS:
+            continue
+        alerts = list(ALERTS.values())
+        ALERTS.clear()
+        try:
+            for text in format_alert_digest(alerts):
+                await bot.send_message(chat_id=OWNER_ID, text=text, parse_mode="HTML", disable_web_page_preview=True)
+        except Exception as e:
+            print(f"[ALERTS] Digest not delivered, keeping it for the next round: {e}")
+            for alert in alerts:
+                key = f"{alert['kind']}|{alert['source']}"
+                if key in ALERTS:
+                    # Merge with what arrived meanwhile
+                    newer = ALERTS[key]
+                    alert["count"] += newer["count"]
+                    alert["last_at"], alert["last_detail"] = newer["last_at"], newer["last_detail"]
+                ALERTS[key] = alert
 
 async def notify_owner_on_error(bot, exception: Exception, source: str = "Unknown"):
     global LAST_ERROR_TIME
     now = time.time()
 
+    tb_full = "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
+    tb_trimmed = "\n".join(tb_full.strip().splitlines()[-25:])  # last 25 lines of traceback
+
     if now - LAST_ERROR_TIME < ERROR_COOLDOWN:
-        return  # Avoid spamming alerts
+        # Too soon for another message: the digest carries it with its count
+        record_alert("error", f"{source}: {type(exception).__name__}", "\n".join(tb_trimmed.splitlines()[-8:]))
+        return
 
     LAST_ERROR_TIME = now
 
-    tb_full = "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
-    tb_trimmed = "\n".join(tb_full.strip().splitlines()[-25:])  # last 25 lines of traceback
-
     msg = (
         f"⚠️ <b>[BOT ERROR]</b>\n"
         f"<b>📍 Source:</b> <code>{source}</code>\n"
@@ -5243,6 +7467,7 @@ async def notify_owner_on_error(bot, exception: Exception, source: str = "Unknow
         await bot.send_message(chat_id=OWNER_ID, text=msg, parse_mode="HTML", disable_web_page_preview=True)
     except Exception as notify_error:
         print(f"[Notify Error] Owner ku msg anupala: {notify_error}")
+        record_alert("error", f"{source}: {type(exception).__name__}", "\n".join(tb_trimmed.splitlines()[-8:]))
         try:
             await bot.send_message(chat_id=OWNER_ID, text="⚠️ Bot crashed, but traceback could not be delivered.", parse_mode="HTML")
         except:
@@ -5250,68 +7475,98 @@ async def notify_owner_on_error(bot, exception: Exception, source: str = "Unknow
 
 async def post_init(app: Application):
     asyncio.create_task(autosave_task())
+    asyncio.create_task(auto_jobs_writer())  # also writes the jobs resumed by load_state()
+    asyncio.create_task(auto_queue_worker(app))
+    asyncio.create_task(progress_ticker(app.bot))
+    asyncio.create_task(breaker_monitor(app.bot))
+    asyncio.create_task(alert_digest_task(app.bot))
     asyncio.create_task(schedule_stat_reports(app))
 
+async def post_shutdown(app: Application):
+    await flush_auto_jobs()
+
 def main():
     print("[BOT] Starting application...")
 
     if not BOT_TOKEN:
         raise ValueError("BOT_TOKEN is not set. Please check your configuration.")
 
-    app = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    # Different chats are handled in parallel; per_chat() keeps each chat's own updates in order and
+    # bounds the running handlers to CONCURRENT_UPDATES, PTB's own bound only caps the backlog
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(max(CONCURRENT_UPDATES, UPDATE_BACKLOG) if CONCURRENT_UPDATES else 0)
+        .rate_limiter(OutboundRateLimiter())
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # --- COMMAND HANDLERS ---
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("ping", ping))
-    app.add_handler(CommandHandler("rules", rules))
-
-    app.add_handler(CommandHandler("setchannelid", set_channel_id))
-    app.add_handler(CommandHandler("setcaption", set_caption))
-    app.add_handler(CommandHandler("resetcaption", reset_caption))
-    app.add_handler(CommandHandler("resetchannelid", reset_channel))
-    app.add_handler(CommandHandler("reset", reset))
-
-    app.add_handler(CommandHandler("adduser", add_user))
-    app.add_handler(CommandHandler("removeuser", remove_user))
-    app.add_handler(CommandHandler("userlist", userlist))
-    
-    app.add_handler(CommandHandler("test8h", test_8h))
-    app.add_handler(CommandHandler("testday", test_daily))
-    app.add_handler(CommandHandler("testweek", test_weekly))
-    app.add_handler(CommandHandler("testmonth", test_monthly))
+    app.add_handler(CommandHandler("start", per_chat(start)))
+    app.add_handler(CommandHandler("help", per_chat(help_command)))
+    app.add_handler(CommandHandler("ping", per_chat(ping)))
+    app.add_handler(CommandHandler("rules", per_chat(rules)))
+
+    app.add_handler(CommandHandler("setchannelid", per_chat(set_channel_id)))
+    app.add_handler(CommandHandler("setcaption", per_chat(set_caption)))
+    app.add_handler(CommandHandler("resetcaption", per_chat(reset_caption)))
+    app.add_handler(CommandHandler("resetchannelid", per_chat(reset_channel)))
+    app.add_handler(CommandHandler("reset", per_chat(reset)))
+
+    app.add_handler(CommandHandler("adduser", per_chat(add_user)))
+    app.add_handler(CommandHandler("removeuser", per_chat(remove_user)))
+    app.add_handler(CommandHandler("userlist", per_chat(userlist)))
+    
+    app.add_handler(CommandHandler("test8h", per_chat(test_8h)))
+    app.add_handler(CommandHandler("testday", per_chat(test_daily)))
+    app.add_handler(CommandHandler("testweek", per_chat(test_weekly)))
+    app.add_handler(CommandHandler("testmonth", per_chat(test_monthly)))
     
     # --- CALLBACK QUERY HANDLERS ---
     app.add_handler(CallbackQueryHandler(
-        handle_settings_callback,
-        pattern=r"^(view_users|view_autosetup|viewsetup[1-4]|backup_config|force_reset|confirm_reset|settings_back|bot_admin_link|backup_restore|cancel_restore|confirm_restore|add_user|remove_user|reset_settings_panel)$"
+        per_chat(handle_settings_callback),
+        pattern=r"^(view_users|view_autosetup|view_latency(?::\d+)?|view_shadow(?::\d+)?|view_queue(?::\d+)?|view_deadletters|replay_deadletters|clear_deadletters|viewsetup\d+|backup_config|force_reset|confirm_reset|settings_back|bot_admin_link|backup_restore|cancel_restore|confirm_restore|add_user|remove_user|reset_settings_panel)$"
     ))
-    app.add_handler(CallbackQueryHandler(handle_callback))
+    app.add_handler(CallbackQueryHandler(per_chat(handle_callback)))
 
     # --- MESSAGE HANDLERS ---
 
     # ZIP restore for owner
     app.add_handler(MessageHandler(
         filters.Document.FileExtension("zip") & filters.User(user_id=OWNER_ID),
-        handle_backup_restore
+        per_chat(handle_backup_restore)
+    ))
+
+    # APKs posted in configured source channels (SOURCE_INDEX is kept current by save_config)
+    app.add_handler(MessageHandler(
+        filters.UpdateType.CHANNEL_POST & filters.Document.ALL & SourceChatFilter(),
+        per_chat(unified_auto_handler)
+    ))
+
+    # ...and APKs in the sources of switched-off setups, only for the owner digest
+    app.add_handler(MessageHandler(
+        filters.UpdateType.CHANNEL_POST & filters.Document.FileExtension("apk") & ~SourceChatFilter() & DisabledSourceFilter(),
+        per_chat(unrouted_channel_post)
     ))
 
-    # Forwarded APKs from channels
+    # Caption edits of those posts (a rotated key) are synced to what was already posted
     app.add_handler(MessageHandler(
-        filters.ChatType.CHANNEL & filters.Document.ALL,
-        unified_auto_handler
+        filters.UpdateType.EDITED_CHANNEL_POST & filters.Document.ALL & SourceChatFilter(),
+        per_chat(auto_edit_handler)
     ))
 
     # Manual uploads
     app.add_handler(MessageHandler(
         filters.ChatType.PRIVATE & filters.Document.ALL,
-        handle_document
+        per_chat(handle_document)
     ))
 
     # General text fallback
     app.add_handler(MessageHandler(
         filters.TEXT & (~filters.COMMAND),
-        handle_text
+        per_chat(handle_text)
     ))
 
     # --- RUN THE BOT ---